@@ -1,35 +1,111 @@
 # -*- coding: utf-8 -*-
  
+import numpy as np
 import pandas as pd
-from glob import glob
 import pdb
 import rules
 from importlib import reload
+from store import Store
+from predicates import parse_where
+from compact import dense
+from tidy import TidyFrame
 
-def load(path='wiki/'):
-    global cat
+# load the csv files under path, only the files that changed since the last
+# load are read, see store.Store
+#
+# if lazy is True, the concatenated dataframe is not built: cat is None and
+# peek/agg only read the column they need from the tables that have it
+#
+# if compact is True, the columns of cat use compact dtypes: small ints and
+# floats, categoricals for repeated strings and sparse arrays for mostly empty
+# columns, see compact. Numbers stored as strings become numbers.
+#
+# if tidy is True, cat is a TidyFrame holding one row per cell of the tables
+# instead of the concatenated dataframe, see tidy: its memory grows with the
+# number of cells, not with the number of distinct columns. cat[column] and
+# the functions below work the same, cat[column] only has the rows of the
+# tables having the column.
+#
+# if distinct is True, a table found several times (the same table included in
+# several pages) is only loaded once, see store.Store
+#
+# the csv files that changed are read by `workers` processes, all the cores by
+# default, and the progress is shown while the files are read and merged
+def load(path='wiki/', lazy=False, compact=False, tidy=False, distinct=False, workers=None):
+    global cat, store, catalog, _numeric
     reload(rules)
-    dataframes = []
-    csv_path_list = glob(path + '/**/*.csv', recursive=True)
-    for csv in csv_path_list:
-        df = pd.read_csv(csv)
-        df.rename(columns=rules.column_mapper, inplace=True)
-        dataframes.append(df)
-    cat = pd.concat(dataframes)
-    print('{} csv file(s) loaded.'.format(len(csv_path_list)))
+    _numeric = {}
+    store = Store(path, distinct=distinct, workers=workers, progress=True)
+    store.refresh()
+    catalog = store.catalog(rules.column_mapper)
+    if lazy:
+        cat = None
+    elif tidy:
+        cat = store.tidy(rules.column_mapper)
+    else:
+        cat = store.concat(rules.column_mapper, compact)
+    print('{} csv file(s) loaded, {} read from csv.'.format(len(store.sources()), store.reread))
+    if store.duplicates:
+        print('{} duplicate table(s) left out.'.format(store.duplicates))
     return True
 
+# get a column, from cat if it is loaded, otherwise from the store. With
+# where=, only the matching rows are returned, see predicates
+def column(col_name, where=None):
+    predicates = parse_where(where)
+    if predicates:
+        frames = [df[col_name] for df in store.scan([col_name], predicates, rules.column_mapper)]
+        return pd.concat(frames) if frames else pd.Series([], name=col_name, dtype=object)
+    if cat is not None:
+        return cat[col_name]
+    return store.column(col_name, rules.column_mapper)
+
+# the numeric values of a column of cat, coerced once and cached until the
+# next load
+def numeric(col_name):
+    if isinstance(cat, TidyFrame):
+        return cat.numeric(col_name)
+    if col_name not in _numeric:
+        _numeric[col_name] = pd.to_numeric(dense(cat[col_name]), errors='coerce').values.astype(np.float64)
+    return _numeric[col_name]
+
+# a size in bytes for humans
+def _size(n):
+    for unit in ['B', 'KB', 'MB']:
+        if n < 1024:
+            return '{:.1f} {}'.format(n, unit) if unit != 'B' else '{} B'.format(int(n))
+        n /= 1024.0
+    return '{:.1f} GB'.format(n)
+
 def show_info():
-    cat.info(verbose=True)
+    if isinstance(cat, TidyFrame):
+        cat.info()
+        return
+    if cat is not None:
+        memory = cat.memory_usage(index=False, deep=True)
+        print('{:40s} {:>8s} {:>16s} {:>10s}'.format('Column', 'Non-Null', 'Dtype', 'Memory'))
+        for i, name in enumerate(cat.columns):
+            col = cat.iloc[:, i]
+            print('{:40s} {:>8d} {:>16s} {:>10s}'.format(
+                str(name), int(col.notna().sum()), str(col.dtype), _size(memory.iloc[i])))
+        print('{} rows, {} columns, {} in memory (index {})'.format(
+            len(cat), len(cat.columns), _size(memory.sum()), _size(cat.index.memory_usage())))
+        return
+    print('{:40s} {:>8s} {:>8s}  {}'.format('Column', 'Tables', 'Rows', 'Dtypes'))
+    for name, locations in sorted(catalog.items()):
+        dtypes = sorted(set(loc['dtype'] for loc in locations))
+        print('{:40s} {:>8d} {:>8d}  {}'.format(
+            name, len(locations), sum(loc['rows'] for loc in locations), ', '.join(dtypes)))
 
-def peek(col_name, dropna=False):
+def peek(col_name, dropna=False, where=None):
     if dropna:
-        print(cat[col_name].dropna())
+        print(column(col_name, where).dropna())
     else:
-        print(cat[col_name])
+        print(column(col_name, where))
 
-def agg(agg, col_name):
-    col = pd.to_numeric(cat[col_name], errors='coerce')
+# compute an aggregate over the values of a column
+def aggregate_values(values, agg, q=0.5):
+    col = pd.to_numeric(values, errors='coerce')
 
     if agg in ['mean', 'avg', 'average', 'ave']:
         return col.mean()
@@ -41,19 +117,124 @@ def agg(agg, col_name):
         return col.sum()
     if agg in ['count', 'size']:
         return col.count()
+    if agg in ['median']:
+        return col.median()
+    if agg in ['quantile', 'percentile']:
+        return col.quantile(q)
+    if agg in ['nunique', 'distinct']:
+        # numbers are compared by value, the other values as strings
+        strings = values[col.isna() & values.notna()].astype(str)
+        return col.nunique() + strings.nunique()
     return None
 
+# the names of the aggregates of aggregate() for the pandas groupby
+_GROUPBY_AGGS = {
+    'mean': 'mean', 'avg': 'mean', 'average': 'mean', 'ave': 'mean',
+    'min': 'min', 'minimum': 'min',
+    'max': 'max', 'maximum': 'max',
+    'sum': 'sum',
+    'count': 'count', 'size': 'count',
+    'median': 'median',
+    'quantile': 'quantile', 'percentile': 'quantile',
+}
+
+# the group keys of a column: numbers by value, so 2009 and '2009' are the
+# same group, the other values as strings
+def _group_keys(values):
+    values = pd.Series(np.asarray(values, dtype=object))
+    col = pd.to_numeric(values, errors='coerce')
+    keys = values.where(values.isna(), values.astype(str))
+    is_int = col.notna() & (col == col.round())
+    keys[col.notna()] = col[col.notna()]
+    keys[is_int] = col[is_int].astype(np.int64)
+    return keys.values
+
+# the numeric values of the columns and the group keys, from cat or from the
+# tables having the columns
+def _numeric_frame(columns, by, predicates):
+    if isinstance(cat, TidyFrame) and not predicates:
+        df = cat.frame(columns + ([by] if by is not None and by not in columns else []))
+        keys = df[by].values if by is not None else None
+        df = pd.DataFrame({col: pd.to_numeric(df[col], errors='coerce').values.astype(np.float64)
+                           for col in columns})
+    elif cat is not None and not predicates:
+        df = pd.DataFrame({col: numeric(col) for col in columns})
+        keys = dense(cat[by]).values if by is not None else None
+    else:
+        extra = [by] if by is not None and by not in columns else []
+        frames = list(store.scan(columns, predicates, rules.column_mapper, numeric=columns, extra=extra))
+        if frames:
+            df = pd.concat(frames, ignore_index=True)
+        else:
+            df = pd.DataFrame({col: np.zeros(0) for col in columns + extra})
+        keys = df[by].values if by is not None else None
+        df = df[columns]
+    if by is None:
+        keys = np.zeros(len(df), dtype=np.int8)
+    return df, _group_keys(keys) if by is not None else keys
+
+# compute several aggregates of several columns in a single pass, optionally
+# per group of rows
+#
+# spec is {column: aggregate or [aggregates]}, aggregates as in agg() except
+# nunique. Without by, returns a Series indexed by (column, aggregate); with
+# by='Year', returns a DataFrame with a row per value of the column by.
+# The numeric values of the columns are cached, so the next queries on the
+# same columns do not convert them again.
+def aggregate(spec, by=None, where=None, q=0.5):
+    def quantile(values):
+        return values.quantile(q)
+
+    funcs = {}
+    for col, aggs in spec.items():
+        funcs[col] = []
+        for name in ([aggs] if isinstance(aggs, str) else aggs):
+            if name not in _GROUPBY_AGGS:
+                raise ValueError("Unknown aggregate '{}', expect one of {}.".format(name, ', '.join(_GROUPBY_AGGS)))
+            func = _GROUPBY_AGGS[name]
+            funcs[col].append(quantile if func == 'quantile' else func)
+
+    columns = list(funcs)
+    df, keys = _numeric_frame(columns, by, parse_where(where))
+    result = df.groupby(pd.Series(keys, name=by), sort=False).agg(funcs)
+    if by is None:
+        if not len(result):
+            result.loc[0] = np.nan
+        return result.iloc[0].rename(None)
+    try:
+        result.sort_index(inplace=True)
+    except TypeError:
+        # numbers and strings in the keys
+        pass
+    return result
+
+# aggregate a column. Without where=, it is answered from the summaries of the
+# tables computed when they were loaded, see summaries: median, quantile (with
+# q) and nunique are then approximate once the tables are long. With where=,
+# the tables that cannot match are skipped and the others are filtered, see
+# predicates.
+def agg(agg, col_name, q=0.5, where=None):
+    if not parse_where(where):
+        return store.summary(col_name, rules.column_mapper).aggregate(agg, q)
+    if agg in _GROUPBY_AGGS:
+        return aggregate({col_name: agg}, where=where, q=q).iloc[0]
+    return aggregate_values(column(col_name, where), agg, q)
+
 def help():
     print('COMMANDS:')
     print('\t', 'q: exit')
     print('\t', 'h: display this message')
     print('VARIABLES:')
-    print('\t', 'cat: access the concatenated dataframe of wikipedia tables')
+    print('\t', 'cat: access the concatenated dataframe of wikipedia tables, None after load(lazy=True), a TidyFrame of cells after load(tidy=True)')
+    print('\t', 'catalog: the tables and files containing each column')
     print('PYTHON FUNCTIONS:')
     print('\t', 'show_info(): show the column information of the concatenated dataframe, run once when this programs starts')
-    print('\t', "load(path): reload csv files under path into a concatenated dataframe and the column name mapping rules, run once when this program starts, default path is 'wiki'")
-    print('\t', "agg(type, column): aggregate the column. type is in ['max', 'min', 'count', 'sum', 'mean'] ")
-    print('\t', "peek(column, dropna=False): peek values in a column, ignore NaN by setting dropna=True")
+    print('\t', "load(path, lazy=False, compact=False, tidy=False, distinct=False, workers=None): reload csv files under path into a concatenated dataframe and the column name mapping rules, run once when this program starts, default path is 'wiki'. With lazy=True, only the columns used by a query are read. With compact=True, the dataframe uses compact dtypes (small numbers, categoricals, sparse columns). With tidy=True, the cells are kept in a long table instead. With distinct=True, a table found in several pages is loaded once. workers is the number of processes reading the csv files, all the cores by default")
+    print('\t', "column(column, where=None): get the values of a column")
+    print('\t', "agg(type, column, q=0.5, where=None): aggregate the column. type is in ['max', 'min', 'count', 'sum', 'mean', 'median', 'quantile', 'nunique'], q is the quantile to compute")
+    print('\t', "aggregate(spec, by=None, where=None, q=0.5): several aggregates of several columns in one pass, spec is like {'games_played': ['mean', 'max'], 'PTS': 'sum'}, by='Year' computes them per value of a column")
+    print('\t', "peek(column, dropna=False, where=None): peek values in a column, ignore NaN by setting dropna=True")
+    print('\t', "where: a filter like ('Year', 'startswith', '2009'), a list of them, or a dict of equalities, see predicates.py")
 
 if __name__ == '__main__':
   
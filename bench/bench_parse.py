@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+# measure the time to parse the tables of a page with each parser backend
+#
+#   python3 bench/bench_parse.py page.html [page.html ...]
+#   python3 bench/bench_parse.py --cache-dir wiki_out/cache
+#   python3 bench/bench_parse.py                  the pages of bench/corpus
+import argparse
+import glob
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from table_extractor import BACKENDS, find_wikitables
+from wikitable import WikiTable
+
+# find and parse every wikitable in a page, returns the number of valid tables
+def parse_page(content, backend, log):
+    nvalid = 0
+    for t in find_wikitables(content, backend):
+        wtable = WikiTable(t, log)
+        wtable.parse()
+        nvalid += wtable.isvalid
+    return nvalid
+
+# the best time of `repeat` runs of parsing a page, and its number of tables
+def time_page(content, backend, repeat, log):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        nvalid = parse_page(content, backend, log)
+        best = min(best, time.perf_counter() - start)
+    return best, nvalid
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the parser backends.')
+    parser.add_argument('PAGE', type=str, nargs='*', help='saved html pages')
+    parser.add_argument('--cache-dir', dest='cache_dir', type=str, default=None,
+                        help='use the pages of a page cache')
+    parser.add_argument('-n', '--repeat', dest='repeat', type=int, default=3,
+                        help='number of runs per page, the best is kept (default=3)')
+    args = parser.parse_args()
+
+    paths = list(args.PAGE)
+    if args.cache_dir:
+        paths += glob.glob(os.path.join(args.cache_dir, 'objects', '*', '*'))
+    if not paths:
+        paths = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus', '*.html')))
+    if not paths:
+        parser.error('no page given')
+
+    log = logging.getLogger('bench_parse')
+    log.setLevel(logging.CRITICAL)
+
+    pages = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            pages.append(f.read())
+    nbytes = sum(map(len, pages))
+    print('{} page(s), {:.1f} MB'.format(len(pages), nbytes / 1e6))
+
+    totals = {}
+    ntables = {}
+    for backend in BACKENDS:
+        if backend == 'lxml':
+            try:
+                import lxml
+            except ImportError:
+                print('{:12s} skipped, lxml is not installed'.format(backend))
+                continue
+        totals[backend] = 0.0
+        ntables[backend] = 0
+        for content in pages:
+            seconds, nvalid = time_page(content, backend, args.repeat, log)
+            totals[backend] += seconds
+            ntables[backend] += nvalid
+
+    baseline = totals['html.parser']
+    for backend, total in totals.items():
+        print('{:12s} {:8.2f} ms/page {:6.2f}x  {} valid table(s)'.format(
+            backend, 1000 * total / len(pages), baseline / total, ntables[backend]))
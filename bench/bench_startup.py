@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+# measure the fixed cost of a run of get_tables.py: the start of the
+# interpreter, the imports and the start of the parse workers, on a job of a
+# few small pages where parsing itself takes almost no time
+#
+#   python3 bench/bench_startup.py
+#   python3 bench/bench_startup.py --pages 3 --max-seconds 1
+#
+# every command is run in a new process, the best time of --repeat runs is
+# reported. The overhead of a job is its time minus the time of importing the
+# parsing modules, which any run pays once. The exit status is 1 when the
+# overhead of a job with the default start method is more than --max-seconds
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.join(BENCH_DIR, '..')
+GET_TABLES = os.path.join(REPO_DIR, 'get_tables.py')
+
+# a small page with a single wikitable
+def small_page(i):
+    rows = ''.join('<tr><td>{}</td><td>Team {}</td><td>{}</td></tr>'.format(2000 + r, r % 3, 10 * r + i)
+                   for r in range(5))
+    return ('<html><body><table class="wikitable"><tr><th>Year</th><th>Team</th><th>GP</th></tr>'
+            '{}</table></body></html>').format(rows)
+
+# write a dump of n small pages, see dump_source
+def write_dump(path, n):
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(n):
+            article = {'url': 'https://en.wikipedia.org/wiki/Page_{}'.format(i),
+                       'article_body': {'html': small_page(i)}}
+            f.write(json.dumps(article) + '\n')
+
+# the best wall time of a command run from the repository, setup() is called
+# before each run
+def measure(command, repeat, setup=None):
+    best = float('inf')
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        subprocess.run(command, cwd=REPO_DIR, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Measure the startup time of get_tables.py.')
+    parser.add_argument('--pages', dest='pages', type=int, default=5,
+                        help='number of small pages of the job (default=5)')
+    parser.add_argument('-p', '--num-process', dest='num_process', type=int, default=4,
+                        help='number of parse workers of the parallel jobs (default=4)')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=3,
+                        help='number of runs of each command, the best is reported (default=3)')
+    parser.add_argument('--max-seconds', dest='max_seconds', type=float, default=0.5,
+                        help='largest overhead allowed for a job with the default start method (default=0.5)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_startup.')
+    try:
+        dump = os.path.join(workdir, 'pages.ndjson')
+        write_dump(dump, args.pages)
+        out = os.path.join(workdir, 'out')
+
+        def clean():
+            shutil.rmtree(out, ignore_errors=True)
+
+        def job(num_process, method):
+            return [sys.executable, GET_TABLES, '-o', out, '-p', str(num_process), '--start-method', method,
+                    '-L', 'ERROR', '--no-memo', 'dump', dump]
+
+        default = multiprocessing.get_start_method()
+        # (name, command, setup, is a job, is checked)
+        cases = [
+            ('python', [sys.executable, '-c', 'pass'], None, False, False),
+            ('get_tables.py -h', [sys.executable, GET_TABLES, '-h'], None, False, False),
+            ('import crawl_worker', [sys.executable, '-c', 'import crawl_worker'], None, False, False),
+            ('{} pages -p 1'.format(args.pages), job(1, default), clean, True, True),
+        ]
+        for method in multiprocessing.get_all_start_methods():
+            cases.append(('{} pages -p {} {}'.format(args.pages, args.num_process, method),
+                          job(args.num_process, method), clean, True, method == default))
+
+        print('{:32s} {:>8s} {:>9s}'.format('command', 'seconds', 'overhead'))
+        slow = []
+        imports = 0.0
+        for name, command, setup, is_job, checked in cases:
+            seconds = measure(command, args.repeat, setup)
+            if name == 'import crawl_worker':
+                imports = seconds
+            if not is_job:
+                print('{:32s} {:8.3f}'.format(name, seconds))
+                continue
+            overhead = max(seconds - imports, 0.0)
+            flag = ''
+            if checked and overhead > args.max_seconds:
+                slow.append(name)
+                flag = '  SLOW'
+            print('{:32s} {:8.3f} {:9.3f}{}'.format(name, seconds, overhead, flag))
+    finally:
+        shutil.rmtree(workdir)
+
+    if slow:
+        print('overhead of more than {} s: {}'.format(args.max_seconds, ', '.join(slow)))
+        sys.exit(1)
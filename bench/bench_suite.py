@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+# measure the throughput and the peak memory of each stage on the frozen
+# corpus of bench/corpus, and compare them with bench/baseline.json
+#
+#   parse         find and parse the wikitables of the pages, no download
+#   save          write the valid tables as csv files
+#   load          load the csv files with agg.py, the cache being empty
+#   load-cached   load them again, the cache being up to date
+#
+#   python3 bench/bench_suite.py                    compare with the baseline
+#   python3 bench/bench_suite.py --save-baseline    store a new baseline
+#
+# the exit status is 1 when a stage is slower than the baseline by more than
+# the tolerance. The baseline depends on the machine, store a new one before
+# comparing on another machine
+import argparse
+import glob
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+import rules
+from store import Store
+from table_extractor import BACKENDS
+from wikitable import WikiPage, save_tables
+
+CORPUS_DIR = os.path.join(BENCH_DIR, 'corpus')
+BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+# a stage is not reported as slower for less than this, short stages are noisy
+MIN_SLOWDOWN = 0.005
+# the time spent at least in the runs of a stage, and the most runs
+MIN_TOTAL = 0.5
+MAX_RUNS = 50
+
+# parse the pages, returns {page: [(name, dataframe), ...]}
+def parse(pages, backend, log):
+    tables = {}
+    for name, content in pages.items():
+        page = WikiPage(name, log, backend=backend)
+        page.parse_tables(content)
+        tables[name] = page.named_dataframes()
+    return tables
+
+# save the tables under outpath, returns the number of bytes written
+def save(tables, outpath, log):
+    for name, named in tables.items():
+        save_tables(named, os.path.join(outpath, name), log)
+    return sum(os.path.getsize(path) for path in glob.glob(os.path.join(outpath, '**', '*.csv'), recursive=True))
+
+# load the csv files under path like agg.load does
+def load(path):
+    store = Store(path)
+    store.refresh()
+    store.concat(rules.column_mapper)
+
+# run a stage, returns the best time of repeat runs and the peak memory of
+# one more run. A short stage is run again until it took MIN_TOTAL seconds in
+# all, so its best time is not a matter of luck. setup() is called before each
+# run and not timed, its result is passed to the stage
+def measure(stage, setup, repeat):
+    best = float('inf')
+    runs, total = 0, 0.0
+    while runs < repeat or (total < MIN_TOTAL and runs < MAX_RUNS):
+        arg = setup()
+        start = time.perf_counter()
+        stage(arg)
+        seconds = time.perf_counter() - start
+        best = min(best, seconds)
+        runs += 1
+        total += seconds
+    arg = setup()
+    tracemalloc.start()
+    stage(arg)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+# run every stage, returns {stage: result}
+def run(pages, backend, repeat, log):
+    workdir = tempfile.mkdtemp(prefix='bench_suite.')
+    try:
+        html_bytes = sum(map(len, pages.values()))
+        tables = parse(pages, backend, log)
+        ntables = sum(len(named) for named in tables.values())
+        ncells = sum(df.size for named in tables.values() for _, df in named)
+
+        # each run of save and load gets its own directory
+        counter = [0]
+        def fresh_dir():
+            counter[0] += 1
+            return os.path.join(workdir, str(counter[0]))
+        def saved_dir():
+            path = fresh_dir()
+            save(tables, path, log)
+            return path
+
+        csv_dir = saved_dir()
+        csv_bytes = save(tables, fresh_dir(), log)
+        load(csv_dir)
+
+        stages = [
+            ('parse', lambda _: parse(pages, backend, log), lambda: None, html_bytes),
+            ('save', lambda path: save(tables, path, log), fresh_dir, csv_bytes),
+            ('load', load, saved_dir, csv_bytes),
+            ('load-cached', load, lambda: csv_dir, csv_bytes),
+        ]
+        results = {}
+        for name, stage, setup, nbytes in stages:
+            seconds, peak = measure(stage, setup, repeat)
+            results[name] = {
+                'seconds': seconds,
+                'tables_per_s': ntables / seconds,
+                'cells_per_s': ncells / seconds,
+                'mb_per_s': nbytes / 1e6 / seconds,
+                'peak_mb': peak / 1e6,
+            }
+        return results, ntables, ncells
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def print_results(results, baseline, tolerance):
+    regressions = []
+    print('{:12s} {:>9s} {:>10s} {:>11s} {:>8s} {:>9s}  {}'.format(
+        'stage', 'ms', 'tables/s', 'cells/s', 'MB/s', 'peak MB', 'vs baseline'))
+    for name, r in results.items():
+        compare = ''
+        if name in baseline:
+            ratio = r['seconds'] / baseline[name]['seconds']
+            compare = '{:5.2f}x time, {:5.2f}x memory'.format(ratio, r['peak_mb'] / baseline[name]['peak_mb'])
+            if ratio > 1 + tolerance and r['seconds'] - baseline[name]['seconds'] > MIN_SLOWDOWN:
+                compare += '  SLOWER'
+                regressions.append(name)
+        print('{:12s} {:9.1f} {:10.0f} {:11.0f} {:8.2f} {:9.1f}  {}'.format(
+            name, 1000 * r['seconds'], r['tables_per_s'], r['cells_per_s'], r['mb_per_s'], r['peak_mb'], compare))
+    return regressions
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark parsing, saving and loading on a frozen corpus.')
+    parser.add_argument('PAGE', type=str, nargs='*', help='saved html pages (default=bench/corpus/*.html)')
+    parser.add_argument('--parser', dest='backend', type=str, default='scan', choices=BACKENDS,
+                        help="how the wikitables are found in a page (default='scan')")
+    parser.add_argument('-n', '--repeat', dest='repeat', type=int, default=3,
+                        help='number of runs per stage, the best is kept (default=3)')
+    parser.add_argument('--baseline', dest='baseline', type=str, default=BASELINE,
+                        help='the baseline file (default=bench/baseline.json)')
+    parser.add_argument('--save-baseline', dest='save_baseline', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--tolerance', dest='tolerance', type=float, default=0.2,
+                        help='slowdown allowed before a stage is reported as slower (default=0.2)')
+    args = parser.parse_args()
+
+    paths = args.PAGE or sorted(glob.glob(os.path.join(CORPUS_DIR, '*.html')))
+    if not paths:
+        parser.error('no page given and bench/corpus is empty')
+
+    log = logging.getLogger('bench_suite')
+    log.setLevel(logging.CRITICAL)
+
+    pages = {}
+    for path in paths:
+        with open(path, 'rb') as f:
+            pages[os.path.splitext(os.path.basename(path))[0]] = f.read()
+
+    results, ntables, ncells = run(pages, args.backend, args.repeat, log)
+    print('{} page(s), {:.1f} MB of html, {} valid table(s), {} cell(s)'.format(
+        len(pages), sum(map(len, pages.values())) / 1e6, ntables, ncells))
+
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['stages']
+
+    regressions = print_results(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'parser': args.backend,
+                'pages': sorted(pages),
+                'stages': results,
+            }, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('baseline saved to {}'.format(args.baseline))
+    elif regressions:
+        print('slower than the baseline: {}'.format(', '.join(regressions)))
+        sys.exit(1)
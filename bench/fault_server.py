@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+# a local stand-in for Wikipedia that injects faults, to try the timeouts,
+# retries and adaptive concurrency of the fetcher
+#
+#   python3 bench/fault_server.py --port 8768 --capacity 8
+#   python3 get_tables.py -o out --no-cache -c 32 --rate 0 --read-timeout 2 \
+#       url $(seq -f 'http://127.0.0.1:8768/wiki/Page_%g' 0 199)
+#
+# /wiki/<name> is a small page with a wikitable. The server handles at most
+# --capacity requests at once and answers 429 with a Retry-After header to the
+# others; the latency grows with the number of requests in flight past half
+# the capacity. A request fails with a 503 with probability --error-rate and
+# hangs for a minute with probability --hang-rate. On exit, the number of
+# requests of each kind is printed
+import argparse
+import random
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# a small page with a single wikitable, its revision id is fixed
+def page(name):
+    rows = ''.join('<tr><td>{}</td><td>Team {}</td><td>{}</td></tr>'.format(2000 + r, r % 3, len(name) * r)
+                   for r in range(5))
+    return ('<html><head><script>"wgRevisionId":1</script></head><body><h1>{}</h1>'
+            '<table class="wikitable"><tbody><tr><th>Year</th><th>Team</th><th>GP</th></tr>{}</tbody></table>'
+            '</body></html>').format(name, rows).encode('utf-8')
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class FaultHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            in_flight = server.in_flight
+            server.peak = max(server.peak, in_flight)
+        try:
+            if in_flight > server.capacity:
+                server.count('429')
+                return self.reply(429, headers={'Retry-After': '1'})
+            draw = random.random()
+            if draw < server.hang_rate:
+                server.count('hang')
+                time.sleep(60)
+                return
+            if draw < server.hang_rate + server.error_rate:
+                server.count('503')
+                return self.reply(503)
+            busy = max(0, in_flight - server.capacity // 2)
+            time.sleep(server.latency * (1 + busy))
+            server.count('200')
+            self.reply(200, page(self.path.rsplit('/', 1)[-1]), {'Content-Type': 'text/html; charset=utf-8'})
+        except (BrokenPipeError, ConnectionResetError):
+            server.count('reset')
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='A local wiki server that injects faults.')
+    parser.add_argument('--port', dest='port', type=int, default=8768,
+                        help='port to listen on (default=8768)')
+    parser.add_argument('--capacity', dest='capacity', type=int, default=8,
+                        help='number of requests served at once, the others get a 429 (default=8)')
+    parser.add_argument('--latency', dest='latency', type=float, default=0.05,
+                        help='seconds to answer a request when the server is not busy (default=0.05)')
+    parser.add_argument('--error-rate', dest='error_rate', type=float, default=0.05,
+                        help='probability of a 503 response (default=0.05)')
+    parser.add_argument('--hang-rate', dest='hang_rate', type=float, default=0.01,
+                        help='probability of a request that hangs for a minute (default=0.01)')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), FaultHandler)
+    server.capacity = args.capacity
+    server.latency = args.latency
+    server.error_rate = args.error_rate
+    server.hang_rate = args.hang_rate
+    server.lock = threading.Lock()
+    server.in_flight = 0
+    server.peak = 0
+    server.counts = {}
+
+    def count(kind):
+        with server.lock:
+            server.counts[kind] = server.counts.get(kind, 0) + 1
+    server.count = count
+
+    print('serving on http://127.0.0.1:{}/wiki/'.format(args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print('responses: {}, at most {} request(s) at once'.format(
+            ', '.join('{} {}'.format(n, kind) for kind, n in sorted(server.counts.items())), server.peak))
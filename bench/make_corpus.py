@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+# generate the frozen html corpus of the benchmark suite, see bench_suite.py
+#
+# the pages imitate the markup of Wikipedia: references, sort keys, links,
+# footnote symbols, comments, navboxes and infoboxes around the wikitables.
+# The output only depends on the seed, the generated files are checked in so
+# the corpus does not change between runs.
+#
+#   python3 bench/make_corpus.py
+import os
+import random
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+TEAMS = ['Chicago', 'Boston', 'L.A. Lakers', 'Detroit', 'San Antonio', 'Miami', 'New York',
+         'Golden State', 'Houston', 'Utah', 'Phoenix', 'Denver', 'Orlando', 'Milwaukee']
+PARTIES = ['Democratic', 'Republican', 'Libertarian', 'Green', 'Independent', 'Constitution']
+NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Miller', 'Davis', 'García',
+         'Rodríguez', 'Wilson', 'Martínez', 'Anderson', 'Taylor', 'Thomas', 'Hernández', 'Moore']
+
+def _page(title, body, rng):
+    navbox_rows = ''.join('<tr><th class="navbox-group">Group {}</th><td class="navbox-list">{}</td></tr>'.format(
+        i, ' &#183; '.join('<a href="/wiki/{0}">{0}</a>'.format(rng.choice(NAMES)) for _ in range(12)))
+        for i in range(8))
+    return '''<!DOCTYPE html>
+<html class="client-nojs" lang="en" dir="ltr">
+<head>
+<meta charset="UTF-8"/>
+<title>{title} - Wikipedia</title>
+<script>document.documentElement.className="client-js";RLCONF={{"wgPageName":"{title}"}};</script>
+<style>.wikitable td {{ padding: 0.2em; }}</style>
+</head>
+<body class="mediawiki ltr sitedir-ltr">
+<div id="content" class="mw-body" role="main">
+<h1 id="firstHeading" class="firstHeading" lang="en">{title}</h1>
+<div id="bodyContent" class="mw-body-content">
+<div class="mw-parser-output">
+<table class="infobox vcard" style="width:22em"><tbody>
+<tr><th colspan="2" class="infobox-above">{title}</th></tr>
+<tr><th scope="row">Born</th><td>March 3, 1963</td></tr>
+<tr><th scope="row">Listed height</th><td>6&#160;ft 6&#160;in (1.98&#160;m)</td></tr>
+</tbody></table>
+<p>This page is part of the benchmark corpus of the table parser.<sup id="cite_ref-1" class="reference"><a href="#cite_note-1">&#91;1&#93;</a></sup></p>
+<!-- <table class="wikitable"><tr><th>Commented out</th></tr><tr><td>1</td></tr></table> -->
+{body}
+<div role="navigation" class="navbox"><table class="nowraplinks navbox-inner"><tbody>{navbox}</tbody></table></div>
+<ol class="references"><li id="cite_note-1"><a href="#cite_ref-1">^</a> <cite class="citation web">Reference.</cite></li></ol>
+</div></div></div>
+</body>
+</html>
+'''.format(title=title, body=body, navbox=navbox_rows)
+
+def _ref(rng):
+    n = rng.randint(1, 40)
+    return '<sup id="cite_ref-{0}" class="reference"><a href="#cite_note-{0}">&#91;{0}&#93;</a></sup>'.format(n)
+
+# a season by season statistics table of a player, with a career row and
+# an all-star row like the pages of basketball players
+def _career_table(rng, first_year, seasons):
+    header = ['Year', 'Team', 'GP', 'GS', 'MPG', 'FG%', '3P%', 'FT%', 'RPG', 'APG', 'SPG', 'BPG', 'PPG']
+    rows = ['<tr>' + ''.join('<th scope="col"><abbr title="{0}">{0}</abbr></th>'.format(h) for h in header) + '</tr>']
+    for i in range(seasons):
+        year = first_year + i
+        season = '{}&#8211;{:02d}'.format(year, (year + 1) % 100)
+        mark = '&#8224;' if rng.random() < 0.1 else ''
+        cells = [
+            '<td style="text-align:left;"><a href="/wiki/{0}_NBA_season" title="{0} NBA season">{1}</a>{2}</td>'.format(
+                year, season, mark),
+            '<td style="text-align:left;"><a href="/wiki/{0}">{0}</a></td>'.format(rng.choice(TEAMS)),
+            '<td>{}</td>'.format(rng.randint(1, 82)),
+            '<td>{}</td>'.format(rng.randint(0, 82)),
+            '<td>{:.1f}</td>'.format(rng.uniform(5, 42)),
+            '<td>.{:03d}</td>'.format(rng.randint(350, 600)),
+            '<td>.{:03d}</td>'.format(rng.randint(0, 450)) if rng.random() < 0.9 else '<td>&#8212;</td>',
+            '<td>.{:03d}</td>'.format(rng.randint(500, 950)),
+            '<td>{:.1f}</td>'.format(rng.uniform(0, 15)),
+            '<td>{:.1f}</td>'.format(rng.uniform(0, 11)),
+            '<td>{:.1f}</td>'.format(rng.uniform(0, 3)),
+            '<td>{:.1f}</td>'.format(rng.uniform(0, 4)),
+        ]
+        ppg = '{:.1f}'.format(rng.uniform(2, 37))
+        if rng.random() < 0.15:
+            cells.append('<td style="background:#CFECEC;">{}*{}</td>'.format(ppg, _ref(rng)))
+        else:
+            cells.append('<td>{}</td>'.format(ppg))
+        rows.append('<tr>' + ''.join(cells) + '</tr>')
+    rows.append('<tr><td style="text-align:left;" colspan="2">Career</td>' +
+                ''.join('<td>{}</td>'.format(rng.randint(1, 1000)) for _ in range(11)) + '</tr>')
+    rows.append('<tr><td style="text-align:left;" colspan="2">All-Star</td>' +
+                ''.join('<td>{}</td>'.format(rng.randint(1, 20)) for _ in range(11)) + '</tr>')
+    return '<table class="wikitable sortable" style="text-align:right;">\n<tbody>' + '\n'.join(rows) + '</tbody></table>\n'
+
+# results of an election, the candidates of a party and the district are
+# merged across rows, notes span several columns
+def _election_table(rng, districts):
+    rows = ['<tr><th scope="col">District</th><th scope="col" colspan="2">Party</th><th scope="col">Candidate</th>'
+            '<th scope="col">Votes</th><th scope="col">%</th><th scope="col">Notes</th></tr>']
+    for d in range(districts):
+        candidates = rng.randint(2, 6)
+        votes = [rng.randint(1000, 250000) for _ in range(candidates)]
+        total = sum(votes)
+        for c in range(candidates):
+            cells = []
+            if c == 0:
+                cells.append('<th scope="row" rowspan="{}"><a href="/wiki/District_{}">District {}</a></th>'.format(
+                    candidates + 1, d + 1, d + 1))
+            party = PARTIES[c % len(PARTIES)]
+            cells.append('<td style="background-color:#{:06x};width:2px;"></td>'.format(rng.randint(0, 0xffffff)))
+            cells.append('<td><a href="/wiki/{0}_Party">{0}</a></td>'.format(party))
+            cells.append('<td>{} {}{}</td>'.format(rng.choice(NAMES), rng.choice(NAMES), _ref(rng) if rng.random() < 0.2 else ''))
+            cells.append('<td>{:,}</td>'.format(votes[c]))
+            cells.append('<td>{:.2f}%</td>'.format(100.0 * votes[c] / total))
+            if c == 0:
+                cells.append('<td rowspan="{}">{}</td>'.format(candidates, rng.choice(['Incumbent re-elected', 'New seat', 'Open seat', ''])))
+            rows.append('<tr>' + ''.join(cells) + '</tr>')
+        rows.append('<tr><td colspan="3">Total votes</td><td>{:,}</td><td>100.00%</td><td></td></tr>'.format(total))
+    return '<table class="wikitable">\n<tbody>' + '\n'.join(rows) + '</tbody></table>\n'
+
+# a schedule where dates and venues are merged across rows and cancelled
+# games span the score columns
+def _schedule_table(rng, weeks):
+    rows = ['<tr><th rowspan="2">Week</th><th rowspan="2">Date</th><th colspan="2">Teams</th>'
+            '<th colspan="2">Score</th><th rowspan="2">Venue</th><th rowspan="2">Attendance</th></tr>',
+            '<tr><th>Home</th><th>Away</th><th>Home</th><th>Away</th></tr>']
+    for w in range(weeks):
+        games = rng.randint(1, 4)
+        for g in range(games):
+            cells = []
+            if g == 0:
+                cells.append('<td rowspan="{}">{}</td>'.format(games, w + 1))
+                cells.append('<td rowspan="{}">{} {}, 2019</td>'.format(
+                    games, rng.choice(['September', 'October', 'November']), rng.randint(1, 28)))
+            cells.append('<td>{}</td>'.format(rng.choice(TEAMS)))
+            cells.append('<td>{}</td>'.format(rng.choice(TEAMS)))
+            if rng.random() < 0.08:
+                cells.append('<td colspan="2"><i>Cancelled</i></td>')
+            else:
+                cells.append('<td>{}</td><td>{}</td>'.format(rng.randint(70, 130), rng.randint(70, 130)))
+            cells.append('<td>{} Arena</td>'.format(rng.choice(NAMES)))
+            cells.append('<td>{:,}</td>'.format(rng.randint(8000, 21000)))
+            rows.append('<tr>' + ''.join(cells) + '</tr>')
+    return '<table class="wikitable">\n<tbody>' + '\n'.join(rows) + '</tbody></table>\n'
+
+# a budget table with three levels of headers
+def _budget_table(rng, years):
+    groups = [('Revenue', [('Taxes', ['Income', 'Payroll', 'Corporate']), ('Other', ['Excise', 'Customs'])]),
+              ('Outlays', [('Mandatory', ['Social Security', 'Medicare', 'Medicaid']), ('Discretionary', ['Defense', 'Non-defense'])]),
+              ('Balance', [('Deficit', ['Amount', '% of GDP'])])]
+    top = ['<th rowspan="3">Fiscal year</th>']
+    middle = []
+    leaf = []
+    for name, subgroups in groups:
+        top.append('<th colspan="{}">{}</th>'.format(sum(len(l) for _, l in subgroups), name))
+        for sub, leaves in subgroups:
+            middle.append('<th colspan="{}">{}</th>'.format(len(leaves), sub))
+            leaf.extend('<th>{}{}</th>'.format(l, _ref(rng) if rng.random() < 0.1 else '') for l in leaves)
+    rows = ['<tr>' + ''.join(top) + '</tr>', '<tr>' + ''.join(middle) + '</tr>', '<tr>' + ''.join(leaf) + '</tr>']
+    for y in range(years):
+        cells = ['<th scope="row">{}</th>'.format(1980 + y)]
+        for _ in range(11):
+            cells.append('<td>${:,}</td>'.format(rng.randint(10000, 2000000)) if rng.random() < 0.5
+                         else '<td>{:,}</td>'.format(rng.randint(10000, 2000000)))
+        cells.append('<td>{:.1f}%</td>'.format(rng.uniform(0.1, 9.9)))
+        rows.append('<tr>' + ''.join(cells) + '</tr>')
+    rows.append('<tr><th scope="row">Total</th>' + ''.join('<td>{:,}</td>'.format(rng.randint(10 ** 6, 10 ** 8)) for _ in range(12)) + '</tr>')
+    return '<table class="wikitable sortable" style="font-size:90%">\n<tbody>' + '\n'.join(rows) + '</tbody></table>\n'
+
+def career_stats_page(rng):
+    body = []
+    for player in range(40):
+        body.append('<h2><span class="mw-headline" id="Player_{0}">Player {0}</span></h2>'.format(player))
+        first_year = rng.randint(1960, 2005)
+        body.append('<h3>Regular season</h3>')
+        body.append(_career_table(rng, first_year, rng.randint(8, 21)))
+        body.append('<h3>Playoffs</h3>')
+        body.append(_career_table(rng, first_year + 1, rng.randint(3, 15)))
+    return _page('NBA career statistics', '\n'.join(body), rng)
+
+def spans_page(rng):
+    body = []
+    for state in range(12):
+        body.append('<h2>State {}</h2>'.format(state))
+        body.append(_election_table(rng, rng.randint(4, 20)))
+        body.append(_schedule_table(rng, rng.randint(8, 18)))
+    return _page('Elections and schedules', '\n'.join(body), rng)
+
+def headers_page(rng):
+    body = []
+    for agency in range(16):
+        body.append('<h2>Agency {}</h2>'.format(agency))
+        body.append(_budget_table(rng, rng.randint(20, 40)))
+    return _page('Federal budget', '\n'.join(body), rng)
+
+# a long article of prose, references and navboxes with only two small
+# tables, most of the bytes of the page are outside the wikitables
+def article_page(rng):
+    words = ['season', 'team', 'league', 'championship', 'the', 'of', 'and', 'in', 'was', 'with', 'game',
+             'points', 'record', 'coach', 'playoffs', 'draft', 'contract', 'injury', 'award', 'career']
+    body = []
+    for section in range(36):
+        body.append('<h2><span class="mw-headline" id="Section_{0}">Section {0}</span></h2>'.format(section))
+        for _ in range(6):
+            sentences = []
+            for _ in range(8):
+                sentence = ' '.join(rng.choice(words) for _ in range(rng.randint(10, 25)))
+                link = '<a href="/wiki/{0}" title="{0}">{0}</a>'.format(rng.choice(NAMES))
+                sentences.append('{} {} {}.{}'.format(link, sentence, rng.choice(TEAMS), _ref(rng)))
+            body.append('<p>' + ' '.join(sentences) + '</p>')
+        if section == 20:
+            body.append(_career_table(rng, 1984, 15))
+        if section == 30:
+            body.append(_career_table(rng, 1985, 8))
+    body.append('<ol class="references">' + ''.join(
+        '<li id="cite_note-{0}"><a href="#cite_ref-{0}">^</a> <cite class="citation news">{1} ({2}). '
+        '<a rel="nofollow" class="external text" href="https://www.example.com/{0}">"{3}"</a>. '
+        '<i>{4}</i>.</cite></li>'.format(n, rng.choice(NAMES), 1980 + n % 40, ' '.join(rng.choice(words) for _ in range(8)),
+                                         rng.choice(TEAMS)) for n in range(250)) + '</ol>')
+    return _page('Basketball player', '\n'.join(body), rng)
+
+PAGES = [
+    ('career_stats.html', career_stats_page),
+    ('spans.html', spans_page),
+    ('headers.html', headers_page),
+    ('article.html', article_page),
+]
+
+if __name__ == '__main__':
+
+    os.makedirs(CORPUS_DIR, exist_ok=True)
+    for i, (name, make) in enumerate(PAGES):
+        html = make(random.Random(i))
+        path = os.path.join(CORPUS_DIR, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(html)
+        print('{} {:.1f} KB'.format(path, len(html.encode('utf-8')) / 1024.0))
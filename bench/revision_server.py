@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+# a local stand-in for Wikipedia whose pages have revisions, to try the
+# incremental re-crawl of the crawl manifest and the revalidation of the page
+# cache
+#
+#   python3 bench/revision_server.py --port 8769 &
+#   python3 get_tables.py -o out --cache-dir cache --rate 0 \
+#       url $(seq -f 'http://127.0.0.1:8769/wiki/Page_%g' 0 99)
+#   curl http://127.0.0.1:8769/edit/Page_3 http://127.0.0.1:8769/edit/Page_7
+#   python3 get_tables.py -o out --cache-dir cache --rate 0 \
+#       url $(seq -f 'http://127.0.0.1:8769/wiki/Page_%g' 0 99)
+#
+# /wiki/<name> is a small page with a wikitable, its revision id and its rows
+# change each time /edit/<name> is requested. A page is sent with an ETag and
+# a Last-Modified header, a request with the If-None-Match or If-Modified-Since
+# of the current revision gets a 304. The second crawl above gets 98 304s and
+# two 200s, skips the 98 unchanged pages and writes the two edited ones. On
+# exit, the number of responses of each kind is printed
+import argparse
+import socketserver
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# a small page with a single wikitable, the rows depend on the revision
+def page(name, revision):
+    rows = ''.join('<tr><td>{}</td><td>Team {}</td><td>{}</td></tr>'.format(2000 + r, r % 3, len(name) * r + revision - 1)
+                   for r in range(5))
+    return ('<html><head><script>"wgRevisionId":{}</script></head><body><h1>{}</h1>'
+            '<table class="wikitable"><tbody><tr><th>Year</th><th>Team</th><th>GP</th></tr>{}</tbody></table>'
+            '</body></html>').format(revision, name, rows).encode('utf-8')
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class RevisionHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        kind, _, name = self.path.strip('/').partition('/')
+        if kind not in ('wiki', 'edit') or not name:
+            server.count('404')
+            return self.reply(404)
+        with server.lock:
+            if kind == 'edit':
+                server.revisions[name] = server.revisions.get(name, 1) + 1
+                server.modified[name] = time.time()
+            revision = server.revisions.get(name, 1)
+            modified = formatdate(server.modified.get(name, server.started), usegmt=True)
+        if kind == 'edit':
+            server.count('edit')
+            return self.reply(200, '{} {}\n'.format(name, revision).encode('utf-8'))
+        headers = {'ETag': '"{}-{}"'.format(name, revision), 'Last-Modified': modified}
+        etag = self.headers.get('If-None-Match')
+        if etag == headers['ETag'] or (etag is None and self.headers.get('If-Modified-Since') == modified):
+            server.count('304')
+            return self.reply(304, headers=headers)
+        time.sleep(server.latency)
+        server.count('200')
+        headers['Content-Type'] = 'text/html; charset=utf-8'
+        self.reply(200, page(name, revision), headers)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='A local wiki server whose pages have revisions.')
+    parser.add_argument('--port', dest='port', type=int, default=8769,
+                        help='port to listen on (default=8769)')
+    parser.add_argument('--latency', dest='latency', type=float, default=0.05,
+                        help='seconds to send a page, a 304 is sent at once (default=0.05)')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), RevisionHandler)
+    server.latency = args.latency
+    server.lock = threading.Lock()
+    # page name -> revision id and time of the last edit, 1 and the start of
+    # the server for a page never edited
+    server.revisions = {}
+    server.modified = {}
+    server.started = time.time()
+    server.counts = {}
+
+    def count(kind):
+        with server.lock:
+            server.counts[kind] = server.counts.get(kind, 0) + 1
+    server.count = count
+
+    print('serving on http://127.0.0.1:{}/wiki/, edit a page with /edit/<name>'.format(args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print('responses: {}'.format(', '.join('{} {}'.format(n, kind) for kind, n in sorted(server.counts.items()))))
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+# the checkpoint of a crawl of get_tables.py
+#
+# the urls of the pages done so far, one per line, appended by the writer
+# thread as soon as a page is saved or skipped as unchanged. A crawl that was
+# interrupted and is started again with --resume does not download or read
+# these pages again; the pages that failed are not in the checkpoint and are
+# tried again. The checkpoint is removed when a crawl completes.
+#
+#   OUT/checkpoint.txt
+
+import os
+
+class Checkpoint:
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        # the urls done by the interrupted crawl
+        self.done = set()
+        self.skipped = 0
+        cut = False
+        if resume:
+            cut = self._load()
+        self.file = open(path, 'a' if resume else 'w', encoding='utf-8')
+        if cut:
+            self.file.write('\n')
+
+    # only the complete lines are taken, the last one may have been cut by
+    # the interruption. Returns True if it was
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except OSError:
+            return False
+        self.done = {line[:-1] for line in lines if line.endswith('\n')}
+        return bool(lines) and not lines[-1].endswith('\n')
+
+    # the urls the interrupted crawl did not do, consumed lazily
+    def pending(self, urls):
+        for url in urls:
+            if url in self.done:
+                self.skipped += 1
+                continue
+            yield url
+
+    # the pages (url, status code, body, error) the interrupted crawl did not
+    # do, for the sources that cannot be given the urls to read
+    def pending_pages(self, pages):
+        for page in pages:
+            if page[0] in self.done:
+                self.skipped += 1
+                continue
+            yield page
+
+    # remember a page as done, written through at once so that a crash loses
+    # at most the page being saved
+    def mark(self, url):
+        self.file.write(url + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    # the crawl went through all its urls, there is nothing to resume
+    def complete(self):
+        self.close()
+        os.remove(self.path)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+# batched cleaning and type inference of table cells
+#
+# the cells of a table are cleaned and converted together instead of one by one,
+# the results are the same as WikiTable._clean_text and
+# WikiTable._extract_data_cell
+
+import re
+import numpy as np
+import pandas as pd
+from unidecode import unidecode
+import rules
+
+# the kinds of the extracted values
+NONE = 0
+INT = 1
+FLOAT = 2
+OBJECT = 3
+# an int outside of int64
+BIGINT = 4
+
+_REGEX_SPECIAL = '.^$*+?{}[]\\|()'
+
+# separates the texts when a batch is cleaned as a single string
+_SEP = '\x1e'
+_CONTEXT_SENSITIVE = ('^', '$', '(?', '\\A', '\\Z', '\\b', '\\B')
+
+# classify a text without commas: a simple int or float is converted here
+# directly, the other texts that int()/float() might accept are left to the
+# per-cell logic, everything else is not a number
+_CLASSIFY = re.compile(
+    r'(?P<int>\s*[+-]?[0-9]{1,18}\s*\Z)'
+    r'|(?P<float>\s*[+-]?(?:(?:[0-9]+\.[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?|[0-9]+[eE][+-]?[0-9]+)\s*\Z)'
+    r'|(?P<numeric>\s*[+-]?(?i:[0-9_.]+(?:e[+-]?[0-9_]+)?|nan|inf|infinity)\s*\Z)')
+
+# if a replace rule only maps single characters, return them, otherwise None
+def _single_chars(pattern):
+    chars = []
+    for part in pattern.split('|'):
+        if len(part) == 1 and part not in _REGEX_SPECIAL:
+            chars.append(part)
+        elif len(part) == 2 and part[0] == '\\' and part[1] in _REGEX_SPECIAL:
+            chars.append(part[1])
+        else:
+            return None
+    return chars
+
+# the cleaning rules of rules.py compiled once
+class CompiledRules:
+
+    def __init__(self, replace_rules, remove_pattern, summary_pattern):
+        # the replace rules in order, a rule only mapping single characters is
+        # done with str.translate, the others with a compiled regex
+        self.replace = []
+        for pattern, repl in replace_rules:
+            chars = _single_chars(pattern)
+            if chars is not None and '\\' not in repl:
+                self.replace.append(({ord(c): repl for c in chars}, None))
+            else:
+                self.replace.append((None, (re.compile(pattern), repl)))
+        self.has_regex_replace = any(table is None for table, _ in self.replace)
+        self.remove = re.compile(remove_pattern)
+        # anchors and lookarounds behave differently on joined texts
+        self.remove_is_local = not any(s in remove_pattern for s in _CONTEXT_SENSITIVE)
+        # the keywords of summary rows
+        self.summary = re.compile(summary_pattern, re.IGNORECASE)
+
+    # apply the replace rules to a text
+    def _replace(self, text):
+        for table, regex in self.replace:
+            if table is not None:
+                text = text.translate(table)
+            else:
+                text = regex[0].sub(regex[1], text)
+        return text
+
+    # clean a single text
+    def clean(self, text):
+        text = _unidecode(self._replace(text))
+        return self.remove.sub('', text.strip())
+
+    # clean a list of texts, they are processed as one string when the rules
+    # allow it
+    def clean_all(self, texts):
+        if not texts:
+            return []
+        joined = _SEP.join(texts)
+        if self.has_regex_replace or not self.remove_is_local or joined.count(_SEP) != len(texts) - 1:
+            return [self.clean(text) for text in texts]
+        joined = _unidecode(self._replace(joined))
+        stripped = [text.strip() for text in joined.split(_SEP)]
+        removed = self.remove.sub('', _SEP.join(stripped)).split(_SEP)
+        if len(removed) != len(texts):
+            # the pattern removed a separator
+            return [self.remove.sub('', text) for text in stripped]
+        return removed
+
+# unidecode, ascii texts are returned as they are
+def _unidecode(text):
+    try:
+        text.encode('ascii')
+        return text
+    except UnicodeEncodeError:
+        return unidecode(text)
+
+_compiled = None
+
+# the compiled rules, compiled on first use
+def compiled_rules():
+    global _compiled
+    if _compiled is None:
+        _compiled = CompiledRules(rules.cell_replace_special_symbols,
+                                  rules.cell_remove_special_symbols,
+                                  rules.summary_row_keywords)
+    return _compiled
+
+# extract the values of cleaned texts
+#
+# has_table tells which cells contain a nested table, fallback(text, has_table)
+# is the per-cell logic used for the texts that are not simple numbers or
+# strings. Returns an object array of the values and an array of their kinds.
+def extract_values(texts, has_table, fallback):
+    n = len(texts)
+    values = np.full(n, None, dtype=object)
+    kinds = np.full(n, NONE, dtype=np.int8)
+    if n == 0:
+        return values, kinds
+
+    no_comma = np.array([text.replace(',', '') for text in texts], dtype=object)
+    groups = [None if m is None else m.lastgroup for m in map(_CLASSIFY.match, no_comma)]
+    simple_int = np.array([g == 'int' for g in groups], dtype=bool)
+    simple_float = np.array([g == 'float' for g in groups], dtype=bool)
+    numeric_like = np.array([g is not None for g in groups], dtype=bool)
+    special = np.array([text[:1] == '$' or text[-1:] == '%' for text in texts], dtype=bool)
+
+    if simple_int.any():
+        # the per-cell logic turns a zero int into a float, keeping the sign
+        # of '-0'
+        ints = no_comma[simple_int].astype(np.int64)
+        zero = ints == 0
+        positions = np.flatnonzero(simple_int)
+        values[positions] = ints.astype(object)
+        kinds[positions] = INT
+        if zero.any():
+            values[positions[zero]] = no_comma[positions[zero]].astype(np.float64).astype(object)
+            kinds[positions[zero]] = FLOAT
+    if simple_float.any():
+        values[simple_float] = no_comma[simple_float].astype(np.float64).astype(object)
+        kinds[simple_float] = FLOAT
+
+    rest = ~(simple_int | simple_float)
+    for i in np.flatnonzero(rest & (numeric_like | special)):
+        values[i] = fallback(texts[i], has_table[i])
+        kinds[i] = _kind(values[i])
+    strings = rest & ~(numeric_like | special) & ~np.asarray(has_table, dtype=bool) \
+        & np.array([bool(text) for text in texts], dtype=bool)
+    values[strings] = np.array(texts, dtype=object)[strings]
+    kinds[strings] = OBJECT
+    return values, kinds
+
+# the kind of a value
+def _kind(value):
+    if value is None:
+        return NONE
+    if type(value) == int:
+        return INT if -2**63 <= value < 2**63 else BIGINT
+    if type(value) == float:
+        return FLOAT
+    return OBJECT
+
+# build a typed column from an object array of values and their kinds, the
+# dtype is the one pandas infers from the list of values: int64 for ints,
+# float64 with NaN for numbers and missing values, object otherwise
+def typed_column(values, kinds):
+    if (kinds == BIGINT).any():
+        # leave the rare cases to pandas, e.g. uint64
+        return pd.Series(values.tolist())
+    if len(kinds) and (kinds == INT).all():
+        return values.astype(np.int64)
+    if len(kinds) and (kinds != OBJECT).all():
+        present = kinds != NONE
+        if present.any():
+            column = np.full(len(values), np.nan)
+            column[present] = values[present].astype(np.float64)
+            return column
+    return values
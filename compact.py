@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# a compact representation of the concatenated dataframe of agg.py
+#
+# the tables have different columns, so their concatenation is mostly empty and
+# a column mixing numbers and strings is stored as python objects. In compact
+# mode a column is stored as:
+#
+#   numbers            the smallest int type holding them (a nullable Int type
+#                      when some are missing), float32 when it holds the values
+#                      exactly, float64 otherwise
+#   mostly missing     a sparse array for numbers, a categorical for strings
+#   repeated strings   a categorical
+#
+# the columns are built one by one from the tables, so the wide frame of
+# python objects is never built.
+
+import numpy as np
+import pandas as pd
+
+# a column is mostly missing when at most this fraction of its values is present
+SPARSE_DENSITY = 0.1
+# strings are stored as a categorical when there are at most this many distinct
+# values per present value
+CATEGORY_RATIO = 0.5
+
+_INT_TYPES = [(np.int8, 'Int8'), (np.int16, 'Int16'), (np.int32, 'Int32'), (np.int64, 'Int64')]
+
+# check if float32 holds the values exactly
+def _fits_float32(values):
+    with np.errstate(over='ignore', invalid='ignore'):
+        return bool(((values.astype(np.float32).astype(np.float64) == values) | np.isnan(values)).all())
+
+# the smallest int types holding values, as (numpy type, nullable type)
+def _int_types(values):
+    lo, hi = values.min(), values.max()
+    for np_type, nullable in _INT_TYPES:
+        info = np.iinfo(np_type)
+        if info.min <= lo and hi <= info.max:
+            return np_type, nullable
+    return None
+
+# a compact numeric column
+def _compact_numeric(series, count):
+    values = series.values.astype(np.float64) if series.dtype.kind == 'f' else series.values
+    sparse = count <= SPARSE_DENSITY * len(series)
+    present = values[~np.isnan(values)] if values.dtype.kind == 'f' else values
+    integral = values.dtype.kind in 'iu' or bool((present == np.round(present)).all())
+    types = _int_types(present) if integral and len(present) else None
+
+    if sparse:
+        float_type = np.float32 if _fits_float32(values.astype(np.float64)) else np.float64
+        array = pd.arrays.SparseArray(values.astype(float_type), fill_value=np.nan)
+        return pd.Series(array, index=series.index, name=series.name)
+    if types is not None and count == len(series):
+        return pd.Series(values.astype(types[0]), index=series.index, name=series.name)
+    if types is not None:
+        return series.astype(np.float64).astype(types[1])
+    if values.dtype.kind == 'f' and _fits_float32(values):
+        return series.astype(np.float32)
+    return series
+
+# a compact column, see above
+def compact_column(series):
+    count = int(series.notna().sum())
+    if pd.api.types.is_string_dtype(series.dtype):
+        series = series.astype(object)
+    if series.dtype == object and count:
+        numeric = pd.to_numeric(series, errors='coerce')
+        is_bool = series.map(type).eq(bool).any()
+        if int(numeric.notna().sum()) == count and not is_bool:
+            series = numeric
+    if series.dtype.kind in 'iuf':
+        return _compact_numeric(series, count)
+    if series.dtype == object:
+        sparse = count <= SPARSE_DENSITY * len(series)
+        if sparse or series.nunique() <= CATEGORY_RATIO * count:
+            try:
+                return series.astype('category')
+            except TypeError:
+                # values that cannot be compared
+                return series
+    return series
+
+# concatenate frames into a compact frame, like pd.concat(frames) with every
+# column made compact
+def compact_concat(frames):
+    if not frames:
+        return pd.DataFrame()
+    frames = [df.loc[:, ~df.columns.duplicated()] for df in frames]
+    columns = list(dict.fromkeys(col for df in frames for col in df.columns))
+    index = frames[0].index.append([df.index for df in frames[1:]])
+    data = {}
+    for col in columns:
+        pieces = [df[col].values if col in df.columns else np.full(len(df), np.nan)
+                  for df in frames]
+        data[col] = compact_column(pd.Series(np.concatenate(pieces), index=index, name=col))
+    return pd.DataFrame(data, index=index, columns=columns)
+
+# a column of a compact frame with a numpy dtype: floats for numbers, objects
+# otherwise
+def dense(series):
+    if isinstance(series.dtype, pd.SparseDtype):
+        series = series.sparse.to_dense()
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.astype(object)
+    if isinstance(series.dtype, pd.api.extensions.ExtensionDtype) and pd.api.types.is_integer_dtype(series.dtype):
+        # the nullable Int types
+        return series.astype(np.float64)
+    return series
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+# the parse workers of get_tables.py
+#
+# a worker is set up by init_worker from the options of the crawl. The
+# functions live here rather than in the main script so the workers can be
+# started with fork, forkserver or spawn: a process that did not run the main
+# script cannot find the functions defined in it.
+#
+# importing this module loads the parsing modules (pandas, bs4, ...) and
+# compiles the rules of rules.py. With fork the workers inherit them from the
+# main process, with forkserver the server imports this module once and the
+# workers it forks share it; only spawn imports everything again per worker.
+
+import multiprocessing
+import os
+import threading
+from urllib.parse import urlparse
+from unidecode import unidecode
+from wikitable import WikiPage
+from column_parser import compiled_rules
+from page_cache import CacheMiss
+from manifest import CrawlManifest, page_revision, content_sha1
+from table_memo import TableMemo, parse_fingerprint
+from stats import stats_line
+from logger import get_logger
+
+# compiled at import, so the forked workers do not compile them again
+compiled_rules()
+
+# the options of the crawl, and the logger, stats file, crawl manifest and
+# table memo of this process
+_worker = {}
+
+# set up the current process, returns its logger
+def init_worker(args, log_queue):
+    name = multiprocessing.current_process().name
+    _worker['args'] = args
+    _worker['log'] = get_logger(name, log_queue, level=args.loglevel, rate=args.log_rate)
+    stats_path = os.path.join(args.outpath, 'logs', 'stats-' + name + '.jsonl')
+    _worker['stats'] = open(stats_path, 'w', encoding='utf-8')
+    # in the main process, the pages parsed inline and the writer thread
+    # both write to the stats file
+    _worker['stats_lock'] = threading.Lock()
+    # the manifest as it was when the crawl started, see manifest
+    _worker['manifest'] = CrawlManifest(os.path.join(args.outpath, 'manifest.json'))
+    _worker['fingerprint'] = parse_fingerprint()
+    # the parsed tables by content hash, shared by the workers, see table_memo
+    _worker['memo'] = None if args.no_memo else TableMemo(os.path.join(args.outpath, 'memo'))
+    return _worker['log']
+
+def close_worker():
+    with _worker['stats_lock']:
+        _worker['stats'].close()
+
+# write the stats of a page as a JSON line of the stats file of the process,
+# a line at a time whatever the thread
+def emit_stats(url, stats):
+    line = stats_line(url, stats, pid=os.getpid()) + '\n'
+    with _worker['stats_lock']:
+        f = _worker['stats']
+        f.write(line)
+        f.flush()
+
+# parse a downloaded page and return (url, list of (table name, dataframe),
+# revision, sha1 of the content, content hashes of the tables), the list is
+# None when the page did not change since the last crawl
+def parse_page(item):
+    url, status, content, error = item
+    args = _worker['args']
+    logger = _worker['log']
+    path = unidecode(urlparse(url).path)
+    if error is not None:
+        if isinstance(error, CacheMiss):
+            logger.warn("Offline mode: {} is not in the cache, skipped.".format(url))
+        else:
+            logger.error("GET {} failed: {}".format(url, error))
+        return url, [], None, None, []
+    logger.info("GET " + url)
+    logger.info("Response: {}".format(status))
+    # only the pages that were found are remembered in the manifest
+    revision, sha1 = (page_revision(content), content_sha1(content)) if status in (200, 304) else (None, None)
+    # the csv files are not checked when the tables go to shards
+    outpath = args.outpath + path if args.output == 'csv' else None
+    if not args.full and sha1 is not None and _worker['manifest'].is_unchanged(
+            url, revision, sha1, outpath, _worker['fingerprint'], args.output):
+        logger.info("{} did not change since the last crawl, skipped.".format(url))
+        return url, None, revision, sha1, None
+    wiki_page = WikiPage(url, logger, backend=args.backend, memo=_worker['memo'])
+    try:
+        wiki_page.parse_tables(content)
+    except Exception as e:
+        logger.error("Unable to parse {}: {}".format(url, e))
+        return url, [], None, None, []
+    finally:
+        emit_stats(url, wiki_page.stats)
+    return url, wiki_page.named_dataframes(), revision, sha1, wiki_page.table_hashes()
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+
+# the choices and defaults of the options of get_tables.py, in a module of
+# their own so that parsing the options (and -h) imports nothing heavy
+
+# the backends for finding the wikitables of a page, see table_extractor
+BACKENDS = ('scan', 'lxml', 'html.parser')
+
+# the SPARQL endpoint of the sparql subcommand, see sparql_source
+DEFAULT_ENDPOINT = 'http://dbpedia.org/sparql'
+
+# the formats of the dumps of the dump subcommand, see dump_source
+DUMP_FORMATS = ('auto', 'enterprise', 'warc')
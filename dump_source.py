@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+# the pages of local Wikipedia dumps, read as a stream
+#
+# enterprise: a Wikimedia Enterprise HTML dump, a .tar.gz of NDJSON files where
+#             every line is an article with its url and html, or a single
+#             .ndjson (or .ndjson.gz) file
+# warc:       a WARC file (or .warc.gz), the html of the response records,
+#             the chunked transfer encoding and the gzip or deflate content
+#             encoding of a response are undone; a record whose body cannot
+#             be decoded is skipped and counted
+#
+# nothing is extracted to disk. The pages without any wikitable are dropped
+# before they are sent to the parse workers.
+
+import gzip
+import json
+import re
+import tarfile
+import zlib
+from defaults import DUMP_FORMATS as FORMATS
+
+# the format of a dump from its name
+def dump_format(path):
+    name = path.lower()
+    if '.warc' in name:
+        return 'warc'
+    return 'enterprise'
+
+# yield (url, html) of the lines of an NDJSON file of articles
+def _iter_ndjson(f):
+    for line in f:
+        if b'wikitable' not in line:
+            # the html of the article is in the line, there is no table to
+            # parse, no need to decode it
+            yield None, None
+            continue
+        article = json.loads(line)
+        html = (article.get('article_body') or {}).get('html')
+        yield article.get('url'), html.encode('utf-8') if html else None
+
+# yield (url, html) of a Wikimedia Enterprise dump, the pages without html
+# are yielded as (None, None) so they are counted
+def iter_enterprise(path):
+    if path.endswith('.ndjson'):
+        with open(path, 'rb') as f:
+            yield from _iter_ndjson(f)
+        return
+    if path.endswith('.ndjson.gz'):
+        with gzip.open(path, 'rb') as f:
+            yield from _iter_ndjson(f)
+        return
+    # 'r|*' reads the tarball as a stream, members are never seeked to
+    with tarfile.open(path, 'r|*') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            f = tar.extractfile(member)
+            yield from _iter_ndjson(f)
+
+# read the header lines of a WARC record, returns the headers or None at the
+# end of the file
+def _warc_headers(f):
+    line = f.readline()
+    while line in (b'\r\n', b'\n'):
+        line = f.readline()
+    if not line:
+        return None
+    if not line.startswith(b'WARC/'):
+        raise ValueError('not a WARC record: {!r}'.format(line[:40]))
+    headers = {}
+    for line in iter(f.readline, b''):
+        line = line.rstrip(b'\r\n')
+        if not line:
+            break
+        name, _, value = line.partition(b':')
+        headers[name.strip().lower().decode('ascii', 'replace')] = value.strip().decode('utf-8', 'replace')
+    return headers
+
+_CHUNK_SIZE = re.compile(rb'[0-9a-fA-F]+[ \t]*(;[^\r\n]*)?\r\n')
+
+# the body of a chunked http response without the chunk sizes. A body that
+# does not start with a chunk size was decoded by the crawler already and is
+# returned as it is
+def _dechunk(body):
+    if not _CHUNK_SIZE.match(body):
+        return body
+    chunks = []
+    pos = 0
+    while True:
+        m = _CHUNK_SIZE.match(body, pos)
+        if m is None:
+            raise ValueError('bad chunk size at byte {}'.format(pos))
+        size = int(m.group(0).split(b';', 1)[0], 16)
+        if size == 0:
+            return b''.join(chunks)
+        chunk = body[m.end():m.end() + size]
+        if len(chunk) < size:
+            raise ValueError('truncated chunked body')
+        chunks.append(chunk)
+        pos = m.end() + size + 2
+
+# the body of an http response without its transfer and content encodings,
+# from the raw http headers. Raises ValueError when it cannot be decoded
+def _decode_body(http_headers, body):
+    headers = {}
+    for line in http_headers.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        headers[name.strip().lower()] = value.strip().lower()
+    if b'chunked' in headers.get(b'transfer-encoding', b''):
+        body = _dechunk(body)
+    codings = [c.strip() for c in headers.get(b'content-encoding', b'').split(b',') if c.strip()]
+    # the codings are undone in the reverse order they were applied
+    for coding in reversed(codings):
+        if coding in (b'identity', b'none'):
+            continue
+        if coding in (b'gzip', b'x-gzip'):
+            if not body.startswith(b'\x1f\x8b'):
+                # decoded by the crawler already
+                continue
+            try:
+                body = gzip.decompress(body)
+            except (OSError, EOFError, zlib.error) as e:
+                raise ValueError('bad gzip body: {}'.format(e))
+        elif coding == b'deflate':
+            try:
+                body = zlib.decompress(body)
+            except zlib.error:
+                # deflate without the zlib header, as some servers send it
+                try:
+                    body = zlib.decompress(body, -zlib.MAX_WBITS)
+                except zlib.error as e:
+                    raise ValueError('bad deflate body: {}'.format(e))
+        else:
+            raise ValueError('unsupported content encoding {}'.format(coding.decode('ascii', 'replace')))
+    return body
+
+# yield (url, html) of the html responses of a WARC file, the other records
+# are yielded as (None, None) so they are counted. The records whose body
+# cannot be decoded are appended to `undecodable` as (url, reason)
+def iter_warc(path, undecodable=None):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        while True:
+            headers = _warc_headers(f)
+            if headers is None:
+                return
+            block = f.read(int(headers.get('content-length', 0)))
+            if headers.get('warc-type') != 'response':
+                yield None, None
+                continue
+            # the http headers, then the body
+            http_headers, _, body = block.partition(b'\r\n\r\n')
+            if b'text/html' not in http_headers.lower():
+                yield None, None
+                continue
+            try:
+                body = _decode_body(http_headers, body)
+            except ValueError as e:
+                if undecodable is not None:
+                    undecodable.append((headers.get('warc-target-uri'), str(e)))
+                yield None, None
+                continue
+            if b'wikitable' not in body:
+                yield None, None
+                continue
+            yield headers.get('warc-target-uri'), body
+
+# stream the pages of dumps with a wikitable, fetch_all has the interface of
+# Fetcher.fetch_all so it can feed a Pipeline
+class DumpSource:
+
+    def __init__(self, paths, fmt='auto'):
+        self.paths = paths
+        self.fmt = fmt
+        # the number of pages read, and of pages with a wikitable
+        self.read = 0
+        self.kept = 0
+        # the (url, reason) of the WARC records whose body could not be
+        # decoded
+        self.undecodable = []
+
+    def pages(self):
+        for path in self.paths:
+            fmt = dump_format(path) if self.fmt == 'auto' else self.fmt
+            pages = iter_warc(path, self.undecodable) if fmt == 'warc' else iter_enterprise(path)
+            for url, html in pages:
+                self.read += 1
+                if url is None or html is None or b'wikitable' not in html:
+                    continue
+                self.kept += 1
+                yield url, html
+
+    # yield (url, status, content, error) for each page with a wikitable,
+    # the urls argument is ignored
+    def fetch_all(self, urls=None):
+        for url, html in self.pages():
+            yield url, 200, html, None
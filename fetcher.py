@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from stats import Stats
+
+# limit the number of requests per second sent to each host
+class HostRateLimiter:
+
+    def __init__(self, rate):
+        # minimum number of seconds between two requests to the same host,
+        # a rate of 0 means no limit
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_slot = {}
+        self.lock = threading.Lock()
+
+    # block until a request to the host of the url is allowed
+    def wait(self, url):
+        if not self.interval:
+            return
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+# the responses worth another try: too many requests and server errors
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# the number of requests in flight, adjusted like the congestion window of
+# TCP (AIMD): it grows by one after `limit` successful responses in a row and
+# is halved on a 429 or 5xx response, a timeout, or when the latency of the
+# responses grows to more than `latency_factor` times the lowest latency seen.
+# It is halved at most once per round trip, the responses of the requests
+# already in flight describe the same overload
+class AdaptiveLimit:
+
+    def __init__(self, maximum, minimum=1, initial=4, latency_factor=2.0):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.latency_factor = latency_factor
+        # the lowest latency and the moving average of the latency, seconds
+        self.min_latency = None
+        self.latency = None
+        self.last_decrease = 0.0
+        self.decreases = 0
+        self.lock = threading.Lock()
+
+    # the number of requests allowed in flight
+    def current(self):
+        return int(self.limit)
+
+    # a response that was not refused, latency is the time to its headers
+    def success(self, latency=None):
+        with self.lock:
+            if latency is not None:
+                # the lowest latency slowly rises, so that a server that got
+                # slower for good is not taken for an overloaded one forever
+                self.min_latency = latency if self.min_latency is None else min(1.01 * self.min_latency, latency)
+                self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+                # below 50 ms the latency is noise, not a queue at the server
+                if self.latency > max(self.latency_factor * self.min_latency, 0.05):
+                    self._decrease()
+                    return
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    # a refused request: a 429 or 5xx response or a timeout
+    def failure(self):
+        with self.lock:
+            self._decrease()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self.last_decrease < (self.latency or 0.0):
+            return
+        self.last_decrease = now
+        self.decreases += 1
+        self.limit = max(self.minimum, self.limit / 2)
+
+# the delay asked by the Retry-After header of a response, in seconds or as a
+# date, None if there is none
+def retry_after(response):
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+# download pages concurrently over a pool of keep-alive connections
+#
+# a request taking more than `timeout` seconds to connect or between two
+# bytes of the response is abandoned. A timeout, a connection error or a 429
+# or 5xx response is tried again up to `retries` times, after the delay of
+# the Retry-After header or else a random delay of up to backoff * 2^attempt
+# seconds (full jitter), so the retries of many requests do not arrive at
+# once. At most `concurrency` requests are in flight, fewer while the server
+# is overloaded, see AdaptiveLimit
+class Fetcher:
+
+    def __init__(self, concurrency=16, rate=10, cache=None, offline=False,
+                 timeout=30, retries=3, backoff=1.0, max_backoff=60.0):
+        self.concurrency = concurrency
+        self.cache = cache
+        self.offline = offline
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limiter = HostRateLimiter(rate)
+        # the pages come from the disk in offline mode, nothing to adapt to
+        self.limit = AdaptiveLimit(concurrency, initial=concurrency if offline else 4)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # url -> Stats of its download, see stats
+        self.stats = {}
+
+    # send a single request, returns (status code, body, response)
+    def _get(self, url):
+        self.limiter.wait(url)
+        if self.cache is not None:
+            return self.cache.revalidate(url, session=self.session, timeout=self.timeout)
+        r = self.session.get(url, timeout=self.timeout)
+        return r.status_code, r.content, r
+
+    # the delay before the attempt following `attempt`
+    def _delay(self, attempt, response=None):
+        delay = retry_after(response)
+        if delay is None:
+            return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        # a little jitter all the same, the server may ask the same delay of
+        # all the requests it refused
+        return min(delay, 10 * self.max_backoff) + random.uniform(0, self.backoff)
+
+    # download a single page with retries, returns (status code, body)
+    def fetch(self, url, stats=None):
+        stats = stats if stats is not None else Stats()
+        if self.cache is not None and self.offline:
+            with stats.timer('download'):
+                return self.cache.fetch(url, offline=True)
+        attempt = 0
+        while True:
+            try:
+                with stats.timer('download'):
+                    status, content, response = self._get(url)
+            except (requests.Timeout, requests.ConnectionError):
+                self.limit.failure()
+                if attempt >= self.retries:
+                    raise
+                delay = self._delay(attempt)
+            else:
+                if status not in RETRY_STATUS:
+                    self.limit.success(response.elapsed.total_seconds())
+                    return status, content
+                self.limit.failure()
+                if attempt >= self.retries:
+                    return status, content
+                delay = self._delay(attempt, response)
+            attempt += 1
+            stats.count('retries')
+            with stats.timer('backoff'):
+                time.sleep(delay)
+
+    # download a single page, returns (url, status code, body, error)
+    def _fetch_one(self, url):
+        stats = self.stats[url] = Stats()
+        try:
+            status, content = self.fetch(url, stats)
+            return url, status, content, None
+        except Exception as e:
+            return url, None, None, e
+
+    # download pages and yield (url, status code, body, error) as soon as
+    # they arrive, the number of downloads in flight follows the adaptive
+    # limit and the url iterable is consumed lazily
+    def fetch_all(self, urls):
+        urls = iter(urls)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            pending = set()
+            while True:
+                while len(pending) < self.limit.current():
+                    url = next(urls, None)
+                    if url is None:
+                        break
+                    pending.add(executor.submit(self._fetch_one, url))
+                if not pending:
+                    break
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    yield future.result()
+
+    def close(self):
+        self.session.close()
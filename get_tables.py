@@ -1,23 +1,20 @@
 # -*- coding: utf-8 -*-
 
-import rdflib
-import io
-import sys
-from rdflib.namespace import FOAF, XSD, RDF
-from rdflib.plugins.sparql import prepareQuery
-import requests
+# only the light modules are imported here, the modules of the parsing and of
+# each subcommand are imported once the options are known, see crawl_worker
 import json
-from wikitable import WikiTable, WikiPage
-from logger import get_logger
 import os
 import multiprocessing
-import urllib
-from SPARQLWrapper import SPARQLWrapper, JSON
-from collections import defaultdict
 from urllib.parse import urlparse
 import argparse
-import pdb
+import glob
 from unidecode import unidecode
+from stats import Stats, read_stats_lines, report
+from manifest import CrawlManifest
+from checkpoint import Checkpoint
+from pipeline import Pipeline
+from logger import LogListener
+from defaults import BACKENDS, DEFAULT_ENDPOINT, DUMP_FORMATS
 
 if __name__ == '__main__':
 
@@ -27,8 +24,47 @@ if __name__ == '__main__':
                         help='the output path')
     parser.add_argument('-L', '--loglevel', dest='loglevel', type=str, default="INFO",
                         help="log level (default='INFO')", choices=('CRITICAL', 'ERROR', 'WARN', 'INFO', 'DEBUG'))
+    parser.add_argument('--log-rate', dest='log_rate', type=float, default=1000,
+                        help="maximum number of log records per second of a process, 0 for no limit (default=1000)")
     parser.add_argument('-p', '--num-process', dest='num_process', type=int, default=8,
                         help="number of process (default=8)")
+    parser.add_argument('--start-method', dest='start_method', type=str,
+                        default=multiprocessing.get_start_method(), choices=multiprocessing.get_all_start_methods(),
+                        help="how the parse workers are started, with forkserver the parsing modules are "
+                             "loaded once by the server (default='{}')".format(multiprocessing.get_start_method()))
+    parser.add_argument('-c', '--concurrency', dest='concurrency', type=int, default=16,
+                        help="maximum number of concurrent downloads, fewer while the server is overloaded (default=16)")
+    parser.add_argument('--rate', dest='rate', type=float, default=10,
+                        help="maximum number of requests per second to a host, 0 for no limit (default=10)")
+    parser.add_argument('--read-timeout', dest='read_timeout', type=float, default=30,
+                        help="seconds to wait for a server to accept the connection or to send the next bytes of a "
+                             "page, not a limit on the whole download (default=30)")
+    parser.add_argument('--retries', dest='retries', type=int, default=3,
+                        help="number of further tries of a download that timed out or got a 429 or 5xx response (default=3)")
+    parser.add_argument('--resume', dest='resume', action='store_true',
+                        help="skip the pages an interrupted crawl already did, see OUT/checkpoint.txt")
+    parser.add_argument('--restart', dest='restart', action='store_true',
+                        help="start over, forgetting the pages an interrupted crawl already did")
+    parser.add_argument('--parser', dest='backend', type=str, default='scan', choices=BACKENDS,
+                        help="how the wikitables are found in a page (default='scan')")
+    parser.add_argument('--cache-dir', dest='cache_dir', type=str, default=None,
+                        help="directory of the page cache (default=OUT/cache)")
+    parser.add_argument('--cache-size', dest='cache_size', type=int, default=1024,
+                        help="maximum size of the page cache in MB (default=1024)")
+    parser.add_argument('--no-cache', dest='no_cache', action='store_true',
+                        help="always download the pages, do not use the page cache")
+    parser.add_argument('--offline', dest='offline', action='store_true',
+                        help="parse only the pages in the page cache, never download")
+    parser.add_argument('--output', dest='output', type=str, default='csv', choices=('csv', 'shards'),
+                        help="write a csv file per table, or append the tables to large shards under OUT/shards (default='csv')")
+    parser.add_argument('--shard-size', dest='shard_size', type=int, default=256,
+                        help="size of a shard in MB before a new one is started (default=256)")
+    parser.add_argument('--no-memo', dest='no_memo', action='store_true',
+                        help="parse every table, do not take the tables parsed before from OUT/memo")
+    parser.add_argument('--memo-size', dest='memo_size', type=int, default=1024,
+                        help="maximum size of OUT/memo in MB (default=1024)")
+    parser.add_argument('--full', dest='full', action='store_true',
+                        help="parse and write every page, even the pages that did not change since the last crawl")
     subparsers = parser.add_subparsers(help='help for subcommand')
 
     parser_url = subparsers.add_parser('url', help='help for url subcommand')
@@ -38,52 +74,291 @@ if __name__ == '__main__':
     parser_sparql = subparsers.add_parser('sparql', help='help for sparql subcommand')
     parser_sparql.add_argument('SPARQL', metavar='file', type=str,
                         help='the path to .sparql file')
+    parser_sparql.add_argument('--endpoint', dest='endpoint', type=str, default=DEFAULT_ENDPOINT,
+                        help="the SPARQL endpoint (default='{}')".format(DEFAULT_ENDPOINT))
+    parser_sparql.add_argument('--page-size', dest='page_size', type=int, default=10000,
+                        help="number of results per SPARQL request (default=10000)")
+    parser_sparql.add_argument('--max-age', dest='max_age', type=float, default=24,
+                        help="reuse the cached SPARQL results younger than this many hours (default=24)")
+
+    parser_dump = subparsers.add_parser('dump', help='help for dump subcommand')
+    parser_dump.add_argument('DUMP', metavar='file', type=str, nargs='+',
+                        help='Wikimedia Enterprise HTML dumps (.tar.gz, .ndjson) or WARC files (.warc, .warc.gz)')
+    parser_dump.add_argument('--format', dest='dump_format', type=str, default='auto', choices=DUMP_FORMATS,
+                        help="the format of the dumps, guessed from their names by default")
 
     args = parser.parse_args()
 
     if hasattr(args, 'URL'):
         urls = args.URL
 
-    if hasattr(args, 'SPARQL'):
-        with open(args.SPARQL, 'r') as f:
-            query_string = f.read()
-            sparql = SPARQLWrapper("http://dbpedia.org/sparql")
-            sparql.setQuery(query_string)
-            sparql.setReturnFormat(JSON)
-            data = sparql.query().convert()
-
-        urls = [b['url']['value'] for b in data['results']['bindings']]
-    
-    LOGGERS = {}
     os.makedirs(args.outpath, exist_ok=True)
     log_dir = os.path.join(args.outpath, 'logs')
     os.makedirs(log_dir, exist_ok=True)
 
-    def init_worker():
-        current_p = multiprocessing.current_process()
-        log_path = os.path.join(log_dir, current_p.name + '.log')
-        LOGGERS[current_p.name] = get_logger(current_p.name, log_path, level=args.loglevel)
+    if args.no_cache and args.offline:
+        parser.error('--offline needs the page cache')
+    # the checkpoint of an interrupted crawl is not thrown away silently
+    checkpoint_path = os.path.join(args.outpath, 'checkpoint.txt')
+    if args.resume and args.restart:
+        parser.error('--resume and --restart cannot be used together')
+    if os.path.exists(checkpoint_path) and not args.resume and not args.restart:
+        parser.error('{} is left by an interrupted crawl, add --resume to skip the pages it did '
+                     'or --restart to start over'.format(checkpoint_path))
+
+    # the context the parse workers are started with. With forkserver, the
+    # server imports crawl_worker once and every worker is forked from it
+    context = multiprocessing.get_context(args.start_method)
+    if args.start_method == 'forkserver':
+        # the server is started with the path of the environment, not
+        # sys.path, it needs this directory to find crawl_worker
+        here = os.path.dirname(os.path.abspath(__file__))
+        os.environ['PYTHONPATH'] = os.pathsep.join(filter(None, [here, os.environ.get('PYTHONPATH')]))
+        context.set_forkserver_preload(['crawl_worker'])
+        # the server imports the modules while this process does the same
+        from multiprocessing import forkserver
+        forkserver.ensure_running()
+
+    # the processes send their log records to the listener thread of this
+    # process, which writes them to logs/<process>.log, see logger
+    log_listener = LogListener(log_dir, level=args.loglevel, context=context)
+    log_listener.start()
+
+    # the parsing modules, imported once the options are known
+    from crawl_worker import init_worker, close_worker, emit_stats, parse_page
+    from wikitable import save_tables, write_ref, read_ref
+    from table_memo import TableMemo, parse_fingerprint
+
+    cache = None
+    if not args.no_cache and not hasattr(args, 'DUMP'):
+        from page_cache import PageCache
+        cache_dir = args.cache_dir or os.path.join(args.outpath, 'cache')
+        cache = PageCache(cache_dir, max_bytes=args.cache_size * 1024 * 1024)
+
+    if hasattr(args, 'SPARQL'):
+        from sparql_source import SparqlSource
+        with open(args.SPARQL, 'r') as f:
+            query_string = f.read()
+        # the urls are streamed into the crawl as the pages of results arrive
+        urls = SparqlSource(query_string, args.endpoint, page_size=args.page_size,
+                            cache_dir=os.path.join(cache.root, 'sparql') if cache is not None else None,
+                            max_age=args.max_age * 3600, offline=args.offline)
+
+    fetcher = None
+    dump = None
+    if hasattr(args, 'DUMP'):
+        # the pages are read from the dumps instead of being downloaded
+        from dump_source import DumpSource
+        dump = DumpSource(args.DUMP, args.dump_format)
+        fetch_all = dump.fetch_all
+        urls = None
+    else:
+        from fetcher import Fetcher
+        fetcher = Fetcher(args.concurrency, args.rate, cache=cache, offline=args.offline,
+                          timeout=args.read_timeout, retries=args.retries)
+        fetch_all = fetcher.fetch_all
+
+    # the pages done so far, an interrupted crawl started again with --resume
+    # skips them, see checkpoint
+    checkpoint = Checkpoint(checkpoint_path, resume=args.resume)
+    if urls is not None:
+        urls = checkpoint.pending(urls)
+    else:
+        def fetch_all(urls, read_all=fetch_all):
+            return checkpoint.pending_pages(read_all(urls))
+
+    # the tables parsed by an older version of the parsing or with other rules
+    # are removed before the workers open the memo, see table_memo
+    memo = None
+    if not args.no_memo:
+        memo = TableMemo(os.path.join(args.outpath, 'memo'), max_bytes=args.memo_size * 1024 * 1024)
+        memo.prune()
+
+    # the revisions and tables of the pages of the last crawl, see manifest
+    manifest = CrawlManifest(os.path.join(args.outpath, 'manifest.json'))
+    # the pages parsed with other rules are parsed again
+    fingerprint = parse_fingerprint()
+
+    # the tables are appended to shards instead of csv files, see shards
+    shard_writer = None
+    if args.output == 'shards':
+        from shards import ShardWriter
+        shard_writer = ShardWriter(os.path.join(args.outpath, 'shards'), max_bytes=args.shard_size * 1024 * 1024)
+
+    # the csv file of a table of a page
+    def table_csv(url, name):
+        return os.path.join(args.outpath + unidecode(urlparse(url).path), name + '.csv')
 
-    def func(url):
+    # the csv file of another page already holding a table, None if there is
+    # none
+    def same_table(url, content_hash):
+        for other_url, name in manifest.holders(content_hash):
+            if other_url != url and os.path.exists(table_csv(other_url, name)):
+                return table_csv(other_url, name)
+        return None
+
+    # before the csv file of a table is replaced or removed, it is moved in
+    # place of the first .ref file pointing to it, and the other .ref files
+    # then point to its new place
+    def release_table(url, name, content_hash):
+        csv = table_csv(url, name)
+        if content_hash is None or not os.path.exists(csv):
+            return
+        refs = [table_csv(u, n)[:-4] + '.ref' for u, n in manifest.holders(content_hash) if (u, n) != (url, name)]
+        refs = [ref for ref in refs if os.path.exists(ref) and read_ref(ref) == os.path.normpath(csv)]
+        if not refs:
+            return
+        new_csv = refs[0][:-4] + '.csv'
+        os.replace(csv, new_csv)
+        os.remove(refs[0])
+        for ref in refs[1:]:
+            write_ref(ref, new_csv)
+
+    # save the tables of a page, runs in the writer thread. The tables of the
+    # last crawl that the page no longer has are removed. A table another page
+    # already has is written as a .ref file pointing to its csv file
+    def write_page(result):
+        url, tables, revision, sha1, hashes = result
         path = unidecode(urlparse(url).path)
-        print('GET', path)
-        os.makedirs(path, exist_ok=True)
-        current_p = multiprocessing.current_process()
-        wiki_page = WikiPage(url, LOGGERS[current_p.name])
-        wiki_page.parse_tables()
-        wiki_page.save(args.outpath + path)
-
-    if args.num_process == 1:
-        log_path = os.path.join(log_dir, 'MainProcess.log')
-        logger = get_logger('MainProcess', log_path, level=args.loglevel)
-        for url in urls:
-            path = unidecode(urlparse(url).path)
-            print('GET', path)
-            wiki_page = WikiPage(url, logger)
-            wiki_page.parse_tables()
-            wiki_page.save(args.outpath + path)
+        if tables is None:
+            skipped.append(url)
+            checkpoint.mark(url)
+            print('SKIP', path, '(unchanged)')
+            return
+        if sha1 is None and not tables:
+            # a page that could not be downloaded or parsed keeps its older
+            # tables, and is not marked as done nor recorded
+            failed.append(url)
+            print('FAIL', path)
+            return
+        stats = Stats()
+        if shard_writer is not None:
+            with stats.timer('shards'):
+                shard_writer.write(url, tables, hashes)
+        else:
+            names = [name for name, _ in tables]
+            refs = {}
+            # the first table of the page with each hash
+            first = {}
+            for name, content_hash in zip(names, hashes):
+                if content_hash is None:
+                    continue
+                other = table_csv(url, first[content_hash]) if content_hash in first else same_table(url, content_hash)
+                if other is not None:
+                    refs[name] = other
+                else:
+                    first[content_hash] = name
+            # the csv files of the last crawl that are not written again as
+            # the same table are handed over to the tables referencing them
+            new_hashes = dict(zip(names, hashes))
+            for name, content_hash in manifest.table_hashes(url).items():
+                if name in refs or new_hashes.get(name) != content_hash:
+                    release_table(url, name, content_hash)
+            save_tables(tables, args.outpath + path, main_log, stats, refs)
+            counts['references'] += len(refs)
+        emit_stats(url, stats)
+        if sha1 is not None:
+            names = [name for name, _ in tables]
+            for name in set(manifest.tables(url)) - set(names) if shard_writer is None else []:
+                for ext in ('.csv', '.ref'):
+                    stale = os.path.join(args.outpath + path, name + ext)
+                    if os.path.exists(stale):
+                        os.remove(stale)
+            manifest.record(url, revision, sha1, names, hashes, parser=fingerprint, output=args.output)
+            checkpoint.mark(url)
+        else:
+            # an error page (404, 5xx after the retries) is tried again by
+            # the next crawl
+            failed.append(url)
+        written.append(url)
+        counts['tables'] += len(tables)
+        print('SAVE', path, '({} table(s), {} page(s) done)'.format(len(tables), len(written)))
+
+    written = []
+    counts = {'tables': 0, 'references': 0}
+    skipped = []
+    # the pages that could not be downloaded, parsed or were not found
+    failed = []
+    for stats_path in glob.glob(os.path.join(log_dir, 'stats-*.jsonl')):
+        os.remove(stats_path)
+    main_log = init_worker(args, log_listener.queue)
+    # no more workers than pages for a few urls
+    num_process = min(args.num_process, len(args.URL)) if hasattr(args, 'URL') else args.num_process
+    if num_process <= 1:
+        pipeline = Pipeline(fetch_all, parse_page, write_page)
+        pipeline.run(urls)
     else:
-        pool = multiprocessing.Pool(args.num_process, initializer=init_worker)
-        pool.map(func, urls)
+        # the pages are downloaded by the fetcher threads of this process,
+        # parsed by the pool and saved by the writer thread as they come
+        pool = context.Pool(num_process, initializer=init_worker, initargs=(args, log_listener.queue))
+        pipeline = Pipeline(fetch_all, parse_page, write_page,
+                            parse_map=pool.imap_unordered, maxsize=4 * num_process)
+        pipeline.run(urls)
         pool.close()
         pool.join()
+    if fetcher is not None:
+        fetcher.close()
+    if shard_writer is not None:
+        shard_writer.close()
+        # the tables replaced by a newer version of their page are dropped
+        # once they are more than half of the shards, see shards
+        from shards import shard_usage, compact
+        live, total = shard_usage(shard_writer.outdir)
+        if live < total / 2:
+            freed = compact(shard_writer.outdir, max_bytes=shard_writer.max_bytes)
+            print('Shards compacted, {:.1f} MB freed.'.format(freed / 1e6))
+    manifest.save()
+    manifest.close()
+    for e in pipeline.errors:
+        main_log.error(e)
+    # a crawl that stopped on an error can be resumed. A crawl that tried all
+    # its pages is complete even if some of them failed, they are listed in
+    # OUT/failed.txt and tried again by the next crawl
+    failed_path = os.path.join(args.outpath, 'failed.txt')
+    if failed:
+        with open(failed_path, 'w', encoding='utf-8') as f:
+            f.write(''.join(url + '\n' for url in failed))
+    elif os.path.exists(failed_path):
+        os.remove(failed_path)
+    if pipeline.errors:
+        checkpoint.close()
+    else:
+        checkpoint.complete()
+
+    if cache is not None:
+        cache.evict()
+    if memo is not None:
+        memo.evict()
+    if dump is not None:
+        print('{} page(s) read from the dumps, {} with a wikitable.'.format(dump.read, dump.kept))
+        for url, reason in dump.undecodable:
+            main_log.warning('WARC record of %s skipped, its body cannot be decoded: %s', url, reason)
+        if dump.undecodable:
+            print('{} WARC record(s) skipped, their body could not be decoded.'.format(len(dump.undecodable)))
+    if checkpoint.skipped:
+        print('{} page(s) done by the interrupted crawl skipped.'.format(checkpoint.skipped))
+    if fetcher is not None and not args.offline:
+        retries = sum(stats.counts.get('retries', 0) for stats in fetcher.stats.values())
+        print('{} download(s) tried again, {} of {} downloads in flight at the end.'.format(
+            retries, fetcher.limit.current(), args.concurrency))
+    print('{} page(s) written, {} unchanged page(s) skipped.'.format(len(written), len(skipped)))
+    if failed:
+        print('{} page(s) failed, see {}.'.format(len(failed), failed_path))
+    print('{} table(s) written, {} of them as a reference to the same table written before.'.format(
+        counts['tables'], counts['references'] + (shard_writer.references if shard_writer is not None else 0)))
+
+    # merge the stats of the processes and the downloads into a report
+    close_worker()
+    lines = []
+    for stats_path in glob.glob(os.path.join(log_dir, 'stats-*.jsonl')):
+        with open(stats_path, 'r', encoding='utf-8') as f:
+            lines.extend(f)
+    pages = read_stats_lines(lines)
+    for url, stats in (fetcher.stats if fetcher is not None else {}).items():
+        pages.setdefault(url, Stats()).merge(stats)
+    with open(os.path.join(log_dir, 'stats.json'), 'w', encoding='utf-8') as f:
+        json.dump({url: stats.to_dict() for url, stats in pages.items()}, f, indent=1)
+    for line in report(pages):
+        main_log.info(line)
+        print(line)
+    log_listener.stop()
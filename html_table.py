@@ -1,34 +1,55 @@
 # -*- coding: utf-8 -*-
 
 import pdb
+from array import array
 
+# convert an html table with merged cells into a grid
+#
+# every distinct <th>/<td> cell gets an integer id, and the grid stores the id
+# of the cell covering each (row, column) slot, so a cell spanning many slots is
+# stored once and its content only has to be extracted once
 class HTMLTableParser:
 
     def __init__(self):
-        self.downward_growing_cells = []
-        self.table_info = []
+        # the distinct cells in document order, the index is the cell id
+        self.cells = []
+        # the rows of the unmerged table, each row is an array of cell ids
+        self.grid = []
+        # the state of each column: the id, start row and rowspan of the cell
+        # growing downward in it
+        self._owner = []
+        self._start = []
+        self._span = []
 
-    # process each row
+    # process each row, row is a list of (colspan, rowspan, cell id)
     def _process_table_info_row(self, rowidx, row):
-        if len(self.downward_growing_cells) == 0:
-            for cell in row:
-                colspan, rowspan, soup = cell
+        if not self._owner:
+            for colspan, rowspan, cellid in row:
                 for _ in range(colspan):
-                    self.downward_growing_cells.append([(0, rowspan, soup)])
-        else:
-            colidx = 0
-            while colidx < len(self.downward_growing_cells):
-                col = self.downward_growing_cells[colidx]
-                start_rowidx, rowspan, soup = col[-1]
-                if rowidx < start_rowidx + rowspan or rowspan == 0:
-                    col.append(col[-1])
+                    self._owner.append(cellid)
+                    self._start.append(0)
+                    self._span.append(rowspan)
+            if self._owner:
+                self.grid.append(array('i', self._owner))
+            return
+
+        owner, start, span = self._owner, self._start, self._span
+        width = len(owner)
+        colidx = 0
+        nextcell = 0
+        while colidx < width:
+            rowspan = span[colidx]
+            if rowidx < start[colidx] + rowspan or rowspan == 0:
+                colidx += 1
+            else:
+                colspan, rowspan, cellid = row[nextcell]
+                nextcell += 1
+                for _ in range(colspan):
+                    owner[colidx] = cellid
+                    start[colidx] = rowidx
+                    span[colidx] = rowspan
                     colidx += 1
-                else:
-                    cell = row.pop(0)
-                    colspan, rowspan, soup = cell
-                    for _ in range(colspan):
-                        self.downward_growing_cells[colidx].append((rowidx, rowspan, soup))
-                        colidx += 1
+        self.grid.append(array('i', owner))
 
     # process a table node
     def parse_soup(self, soup):
@@ -39,28 +60,34 @@ class HTMLTableParser:
 
             for rowidx, tr in enumerate(tbody.find_all('tr', recursive=False)):
                 table_row_info = []
-                for cellidx, cell in enumerate(tr.find_all(['th', 'td'], recursive=False)):
+                for cell in tr.find_all(['th', 'td'], recursive=False):
                     colspan = int(cell.get('colspan', '1'))
                     rowspan = int(cell.get('rowspan', '1'))
-                    table_row_info.append((colspan, rowspan, cell))
-                self.table_info.append(table_row_info)
+                    table_row_info.append((colspan, rowspan, len(self.cells)))
+                    self.cells.append(cell)
+                if table_row_info or self._owner:
+                    self._process_table_info_row(rowidx, table_row_info)
 
-            for rowidx, row in enumerate(self.table_info):
-                self._process_table_info_row(rowidx, row)
-    
     def print(self):
             from prettytable import PrettyTable
             pt = PrettyTable()
-            for i in range(len(self.downward_growing_cells[0])):
-                row = []
-                for col in self.downward_growing_cells:
-                    start, rowspan, soup = col[i]
-                    row.append(soup.text.strip())
-                pt.add_row(row)
+            texts = [cell.text.strip() for cell in self.cells]
+            for row in self.grid:
+                pt.add_row([texts[cellid] for cellid in row])
             print(str(pt))
 
+    # the distinct cells, indexed by the ids in the grid
+    def get_cells(self):
+        return self.cells
+
+    # the rows of cell ids
+    def get_grid(self):
+        return self.grid
+
+    # the unmerged table as columns of cells
     def get_columns(self):
-        return [[tup[2] for tup in col] for col in self.downward_growing_cells]
+        width = len(self._owner)
+        return [[self.cells[row[colidx]] for row in self.grid] for colidx in range(width)]
 
 if __name__ == '__main__':
     import sys, io
@@ -1,24 +1,129 @@
 # -*- coding: utf-8 -*-
 
+# the logging of the crawl through a queue
+#
+# a process only puts its records on a queue (QueueHandler), the listener
+# thread of the main process writes them to the log file of the process they
+# come from, <log_dir>/<process>.log, and to stderr. Nothing is written in the
+# parse workers.
+#
+# a record is only formatted when its level is enabled: the values are given
+# as arguments, log.debug('%s', table), not as a formatted string, and the
+# costly ones (whole tables) are only logged at DEBUG. A process sends at most
+# `rate` records per second, the records over the limit are dropped and
+# counted, the warnings and errors always pass.
+
+import io
 import logging
+import logging.handlers
+import multiprocessing
 import os
 import sys
-import io
+import time
+
+FORMAT = '%(asctime)s %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s'
+
+_stderr = None
+
+# stderr as utf-8, wrapped once
+def _utf8_stderr():
+    global _stderr
+    if _stderr is None:
+        _stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', line_buffering=True)
+    return _stderr
+
+# drop the records of a logger over `rate` records per second, with bursts of
+# up to `burst` records
+class RateLimit(logging.Filter):
+
+    def __init__(self, rate, burst=None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        # the number of records dropped since the last one sent
+        self.dropped = 0
+
+    def filter(self, record):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1 and record.levelno < logging.WARNING:
+            self.dropped += 1
+            return False
+        self.tokens = max(self.tokens - 1, 0)
+        # the message is left alone, the formatter of the listener shows the
+        # count, see _Formatter
+        record.dropped = self.dropped
+        self.dropped = 0
+        return True
+
+# the format of the listener, the number of records dropped before a record
+# (see RateLimit) is written before its message
+class _Formatter(logging.Formatter):
+
+    def format(self, record):
+        dropped = getattr(record, 'dropped', 0)
+        if dropped:
+            record = logging.makeLogRecord(dict(record.__dict__, args=None, dropped=0,
+                msg='({} record(s) dropped) {}'.format(dropped, record.getMessage())))
+        return super().format(record)
+
+# write each record to the log file named after its logger
+class _FilePerLogger(logging.Handler):
+
+    def __init__(self, log_dir):
+        super().__init__()
+        self.log_dir = log_dir
+        self.files = {}
+
+    def emit(self, record):
+        handler = self.files.get(record.name)
+        if handler is None:
+            path = os.path.join(self.log_dir, record.name + '.log')
+            handler = self.files[record.name] = logging.FileHandler(path, 'w', 'utf-8')
+            handler.setFormatter(self.formatter)
+        handler.emit(record)
+
+    def close(self):
+        for handler in self.files.values():
+            handler.close()
+        super().close()
+
+# the queue and the listener writing the records of all processes, to be
+# started in the main process before the workers. context is the
+# multiprocessing context the workers are started with
+class LogListener:
+
+    def __init__(self, log_dir, level='INFO', context=None):
+        os.makedirs(log_dir, exist_ok=True)
+        self.queue = (context or multiprocessing).Queue()
+        formatter = _Formatter(FORMAT)
+        self.files = _FilePerLogger(log_dir)
+        self.files.setFormatter(formatter)
+        stderr = logging.StreamHandler(_utf8_stderr())
+        stderr.setFormatter(formatter)
+        stderr.setLevel(level)
+        self.listener = logging.handlers.QueueListener(self.queue, self.files, stderr)
+
+    def start(self):
+        self.listener.start()
+
+    # write the records left in the queue and close the files
+    def stop(self):
+        self.listener.stop()
+        self.files.close()
 
-def get_logger(name, logpath, level='INFO'):
+# a logger sending its records to the queue of a LogListener, rate is the
+# maximum number of records per second (0 for no limit)
+def get_logger(name, queue, level='INFO', rate=0):
     log = logging.getLogger(name)
     log.setLevel(level)
     log.handlers.clear()
-    dirpath = os.path.join('.' + os.path.dirname(logpath))
-    os.makedirs(dirpath, exist_ok=True)
-    formatter = logging.Formatter('%(asctime)s %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s')
-    fileHandler = logging.FileHandler(logpath, 'w', 'utf-8')
-    fileHandler.setFormatter(formatter)
-
-    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
-
-    stdErrHandler = logging.StreamHandler(sys.stderr)
-    stdErrHandler.setFormatter(formatter)
-    log.addHandler(fileHandler)
-    log.addHandler(stdErrHandler)
-    return log
\ No newline at end of file
+    log.propagate = False
+    handler = logging.handlers.QueueHandler(queue)
+    if rate:
+        handler.addFilter(RateLimit(rate))
+    log.addHandler(handler)
+    return log
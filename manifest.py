@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+# the crawl manifest of get_tables.py
+#
+# remembers for each url the revision id of the page, the sha1 of its content,
+# the fingerprint of the parsing (see table_memo), the output the tables went
+# to ('csv' or 'shards') and the tables written for it with their content
+# hashes, so a later crawl does not parse or write the
+# pages that did not change. With the page cache, an unchanged page is only
+# revalidated with the server, see page_cache.
+#
+# a page recorded during a crawl is appended to the journal, a JSON line per
+# page, and the journal is folded into manifest.json by save(), at the end of
+# the crawl or once the journal is as long as the manifest. Loading replays
+# the journal over the manifest, so a page recorded before a crash is not lost.
+#
+#   OUT/manifest.json
+#   OUT/manifest.json.journal
+
+import hashlib
+import json
+import os
+import re
+
+MANIFEST_VERSION = 1
+
+# the revision id MediaWiki puts in the configuration script of a page
+_REVISION = re.compile(rb'"wgRevisionId"\s*:\s*([0-9]+)')
+
+# the revision id of a page, None if the page does not tell it
+def page_revision(content):
+    m = _REVISION.search(content[:1 << 16]) or _REVISION.search(content)
+    return int(m.group(1)) if m and int(m.group(1)) else None
+
+def content_sha1(content):
+    return hashlib.sha1(content).hexdigest()
+
+class CrawlManifest:
+
+    def __init__(self, path):
+        self.path = path
+        self.journal_path = path + '.journal'
+        # url -> {'revision', 'sha1', 'parser', 'output', 'tables', 'hashes'}
+        self.pages = self._load()
+        # the journal file, opened on the first record, and its number of
+        # lines
+        self._journal = None
+        self._journaled = 0
+        # the number of pages in manifest.json
+        self._saved = len(self.pages)
+        # content hash -> [(url, table name)], built on first use
+        self._holders = None
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        pages = manifest['pages'] if manifest.get('version') == MANIFEST_VERSION else {}
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # the last line cut by a crash
+                        continue
+                    if record.get('version') == MANIFEST_VERSION:
+                        pages[record['url']] = record['page']
+        except OSError:
+            pass
+        return pages
+
+    # write the whole manifest and empty the journal
+    def save(self):
+        tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'pages': self.pages}, f)
+        os.replace(tmp, self.path)
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.journal_path, 'w', encoding='utf-8')
+        self._journaled = 0
+        self._saved = len(self.pages)
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    # check if the page is the one of the last crawl, parsed with the same
+    # fingerprint and written to the same output, and its tables are still
+    # under outpath (not checked if outpath is None): the revision ids are
+    # compared when both are known, the content hashes otherwise
+    def is_unchanged(self, url, revision, sha1, outpath, parser=None, output='csv'):
+        entry = self.pages.get(url)
+        if entry is None or entry.get('parser') != parser or entry.get('output') != output:
+            return False
+        if revision is not None and entry['revision'] is not None:
+            same = revision == entry['revision']
+        else:
+            same = sha1 == entry['sha1']
+        if outpath is None:
+            return same
+        return same and all(os.path.exists(os.path.join(outpath, name + '.csv'))
+                            or os.path.exists(os.path.join(outpath, name + '.ref')) for name in entry['tables'])
+
+    # the table names written for a url by the last crawl
+    def tables(self, url):
+        entry = self.pages.get(url)
+        return entry['tables'] if entry is not None else []
+
+    # the content hash of each table written for a url by the last crawl,
+    # {table name: hash}
+    def table_hashes(self, url):
+        entry = self.pages.get(url)
+        return dict(zip(entry['tables'], entry.get('hashes', []))) if entry is not None else {}
+
+    # the (url, table name) of the tables of the last crawl with a content hash
+    def holders(self, content_hash):
+        if self._holders is None:
+            self._holders = {}
+            for url in self.pages:
+                self._add_holders(url)
+        return self._holders.get(content_hash, [])
+
+    def _add_holders(self, url):
+        for name, content_hash in self.table_hashes(url).items():
+            if content_hash is not None:
+                self._holders.setdefault(content_hash, []).append((url, name))
+
+    # remember the page written for a url, appended to the journal at once
+    def record(self, url, revision, sha1, tables, hashes=None, parser=None, output='csv'):
+        if self._holders is not None:
+            for name, content_hash in self.table_hashes(url).items():
+                if content_hash is not None:
+                    self._holders[content_hash].remove((url, name))
+        page = {'revision': revision, 'sha1': sha1, 'parser': parser, 'output': output, 'tables': tables,
+                'hashes': hashes if hashes is not None else [None] * len(tables)}
+        self.pages[url] = page
+        if self._holders is not None:
+            self._add_holders(url)
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        self._journal.write(json.dumps({'version': MANIFEST_VERSION, 'url': url, 'page': page}) + '\n')
+        self._journal.flush()
+        self._journaled += 1
+        # folded once the journal is as long as manifest.json, which then
+        # doubles at most, so writing it costs O(pages) in all
+        if self._journaled >= max(1000, self._saved):
+            self.save()
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import threading
+
+# raised when a page is requested in offline mode but it is not in the cache
+class CacheMiss(KeyError):
+    pass
+
+# a content-addressed on-disk cache of downloaded pages
+#
+# the layout of the cache directory is
+#
+#   index/<sha1 of url>.json     metadata of the last response of the url
+#   objects/<xx>/<sha1 of body>  the response body, shared by identical pages
+#
+# the modification time of an index file is the last time the entry was used,
+# which is used for LRU eviction
+class PageCache:
+
+    def __init__(self, root, max_bytes=1 << 30):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.index_dir = os.path.join(root, 'index')
+        self.objects_dir = os.path.join(root, 'objects')
+        os.makedirs(self.index_dir, exist_ok=True)
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    # hex digest of some bytes
+    def _digest(self, data):
+        return hashlib.sha1(data).hexdigest()
+
+    # path of the index entry of an url
+    def _entry_path(self, url):
+        return os.path.join(self.index_dir, self._digest(url.encode('utf-8')) + '.json')
+
+    # path of a stored body
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    # write a file atomically so that concurrent readers never see half of it
+    def _write_atomic(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # the fetcher threads of a process may store the same body at once
+        tmp = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    # get the index entry of an url, None if the url is not cached
+    def lookup(self, url):
+        try:
+            with open(self._entry_path(url), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(self._object_path(entry['digest'])):
+            return None
+        return entry
+
+    # read the cached body of an entry
+    def read(self, entry):
+        with open(self._object_path(entry['digest']), 'rb') as f:
+            return f.read()
+
+    # mark an url as recently used
+    def touch(self, url):
+        try:
+            os.utime(self._entry_path(url))
+        except OSError:
+            pass
+
+    # store a response body of an url together with its validators
+    def store(self, url, content, etag=None, last_modified=None):
+        digest = self._digest(content)
+        object_path = self._object_path(digest)
+        if not os.path.exists(object_path):
+            self._write_atomic(object_path, content)
+        entry = {
+            'url': url,
+            'digest': digest,
+            'size': len(content),
+            'etag': etag,
+            'last_modified': last_modified,
+        }
+        self._write_atomic(self._entry_path(url), json.dumps(entry).encode('utf-8'))
+        return entry
+
+    # get a page, either from the cache or from the network
+    #
+    # a cached page is revalidated with If-None-Match/If-Modified-Since, so an
+    # unchanged page costs a 304 response instead of a full download. In
+    # offline mode the network is never used. Returns (status code, body).
+    def fetch(self, url, session=None, offline=False, timeout=None):
+        if offline:
+            entry = self.lookup(url)
+            if entry is None:
+                raise CacheMiss(url)
+            self.touch(url)
+            return 200, self.read(entry)
+        status, content, _ = self.revalidate(url, session, timeout)
+        return status, content
+
+    # get a page from the network, revalidating the cached copy if there is
+    # one. Returns (status code, body, response), the response gives the
+    # headers and the latency of the request
+    def revalidate(self, url, session=None, timeout=None):
+        entry = self.lookup(url)
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        if session is None:
+            # imported only when there is no session of the fetcher
+            import requests
+            session = requests
+        r = session.get(url, headers=headers, timeout=timeout)
+        if r.status_code == 304 and entry is not None:
+            self.touch(url)
+            return 304, self.read(entry), r
+        if r.status_code == 200:
+            self.store(url, r.content, r.headers.get('ETag'), r.headers.get('Last-Modified'))
+        return r.status_code, r.content, r
+
+    # remove the least recently used entries until the bodies fit in max_bytes
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.index_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.index_dir, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+                entries.append((os.path.getmtime(path), path, entry))
+            except (OSError, ValueError):
+                continue
+
+        # bodies are shared, so a body is counted once and only removed when
+        # no entry refers to it anymore
+        refs = {}
+        sizes = {}
+        for _, _, entry in entries:
+            refs[entry['digest']] = refs.get(entry['digest'], 0) + 1
+            sizes[entry['digest']] = entry['size']
+        total = sum(sizes.values())
+
+        removed = 0
+        entries.sort(key=lambda e: e[0])
+        for _, path, entry in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            removed += 1
+            digest = entry['digest']
+            refs[digest] -= 1
+            if refs[digest] == 0:
+                try:
+                    os.remove(self._object_path(digest))
+                except OSError:
+                    pass
+                total -= sizes[digest]
+        return removed
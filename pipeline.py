@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import queue
+import threading
+
+# marks the end of a stage's output
+_DONE = object()
+
+# a streaming crawl pipeline
+#
+#   fetcher threads -> bounded queue -> parse workers -> bounded queue -> writer
+#
+# every stage starts working as soon as the first page arrives, and at most
+# `maxsize` pages are between the fetch stage and the writer at any time, so
+# the memory stays flat however many urls are given
+class Pipeline:
+
+    def __init__(self, fetch_all, parse, write, parse_map=map, maxsize=16):
+        # fetch_all(urls) yields downloaded pages
+        self.fetch_all = fetch_all
+        # parse(page) runs in the parse workers and returns a result
+        self.parse = parse
+        # write(result) saves a result in the writer thread
+        self.write = write
+        # parse_map(parse, pages) yields the parse results, e.g. the
+        # imap_unordered of a process pool
+        self.parse_map = parse_map
+        self.fetched = queue.Queue(maxsize)
+        self.parsed = queue.Queue(maxsize)
+        self.slots = threading.BoundedSemaphore(maxsize)
+        self.errors = []
+
+    # download the pages and put them into the fetched queue
+    def _fetch_stage(self, urls):
+        try:
+            for page in self.fetch_all(urls):
+                self.slots.acquire()
+                self.fetched.put(page)
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            self.fetched.put(_DONE)
+
+    # iterate over the fetched pages
+    def _iter_fetched(self):
+        while True:
+            page = self.fetched.get()
+            if page is _DONE:
+                return
+            yield page
+
+    # save the parsed results
+    def _write_stage(self):
+        while True:
+            result = self.parsed.get()
+            if result is _DONE:
+                return
+            try:
+                self.write(result)
+            except Exception as e:
+                self.errors.append(e)
+            finally:
+                self.slots.release()
+
+    # run the pipeline over urls until every page is written
+    def run(self, urls):
+        fetch_thread = threading.Thread(target=self._fetch_stage, args=(urls,), daemon=True)
+        write_thread = threading.Thread(target=self._write_stage, daemon=True)
+        fetch_thread.start()
+        write_thread.start()
+        try:
+            for result in self.parse_map(self.parse, self._iter_fetched()):
+                self.parsed.put(result)
+        finally:
+            self.parsed.put(_DONE)
+            write_thread.join()
+        fetch_thread.join()
+        return self.errors
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# row filters of the where= argument of agg.py
+#
+# a predicate is a tuple (column, op, value):
+#
+#   ('Year', '==', 2009)            numeric equality when value is a number
+#   ('Team', '==', 'LAL')           string equality otherwise
+#   ('games_played', '>=', 10)      <, <=, >, >= compare numerically
+#   ('Team', 'in', ['LAL', 'BOS'])  any of the values
+#   ('Year', 'startswith', '2009')  string prefix, matches 2009 and '2009-10'
+#   ('Year', 'match', '20[01]')     regular expression match at the start
+#
+# where= is a predicate, a list of predicates that must all hold, or a dict
+# {column: value} of equalities. A missing value never matches.
+
+import numbers
+import re
+import numpy as np
+import pandas as pd
+
+OPS = ('==', '!=', '<', '<=', '>', '>=', 'in', 'startswith', 'match')
+
+_COMPARE = {
+    '<': np.less,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '>=': np.greater_equal,
+}
+
+# a list of (column, op, value) from a where= argument
+def parse_where(where):
+    if where is None:
+        return []
+    if isinstance(where, dict):
+        return [(col, '==', value) for col, value in where.items()]
+    if isinstance(where, tuple):
+        where = [where]
+    predicates = []
+    for predicate in where:
+        col, op, value = predicate
+        if op not in OPS:
+            raise ValueError("Unknown operator '{}', expect one of {}.".format(op, ', '.join(OPS)))
+        predicates.append((col, op, value))
+    return predicates
+
+def _is_number(value):
+    return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+# True if may_match needs the distinct values of the summary of the column,
+# not only its count, min and max
+def needs_values(op, value):
+    if op == 'in':
+        return any(needs_values('==', v) for v in value)
+    return not ((op == '==' and _is_number(value)) or op in _COMPARE)
+
+# check if a table may have rows matching a predicate, from the summary of the
+# column (see summaries.summarize_frame), False means the table can be skipped
+def may_match(summary, op, value):
+    if op == 'in':
+        return any(may_match(summary, '==', v) for v in value)
+    if op == '!=':
+        return summary['values'] is None or any(v != str(value) for v in summary['values'])
+    if (op == '==' and _is_number(value)) or op in _COMPARE:
+        if not summary['count']:
+            return False
+        lo, hi = summary['min'], summary['max']
+        if op == '==':
+            return lo <= value <= hi
+        if op in ('<', '<='):
+            return _COMPARE[op](lo, value)
+        return _COMPARE[op](hi, value)
+    if summary['values'] is None:
+        return True
+    if op == '==':
+        return str(value) in summary['values']
+    if op == 'startswith':
+        return any(v.startswith(value) for v in summary['values'])
+    if op == 'match':
+        pattern = re.compile(value)
+        return any(pattern.match(v) for v in summary['values'])
+    return True
+
+# the rows of a column matching a predicate, as a boolean array. numeric is
+# the column already converted to floats, if it is known
+def evaluate(series, op, value, numeric=None):
+    if op == 'in':
+        mask = np.zeros(len(series), dtype=bool)
+        for v in value:
+            mask |= evaluate(series, '==', v, numeric)
+        return mask
+    present = series.notna().values
+    if (op in ('==', '!=') and _is_number(value)) or op in _COMPARE:
+        if numeric is None:
+            numeric = pd.to_numeric(series, errors='coerce').values.astype(np.float64)
+        present = ~np.isnan(numeric)
+        with np.errstate(invalid='ignore'):
+            if op == '==':
+                return present & (numeric == value)
+            if op == '!=':
+                return present & (numeric != value)
+            return present & _COMPARE[op](numeric, value)
+    strings = series.astype(str)
+    if op == '==':
+        return present & (strings == str(value)).values
+    if op == '!=':
+        return present & (strings != str(value)).values
+    if op == 'startswith':
+        return present & strings.str.startswith(value).values.astype(bool)
+    return present & strings.str.match(value).values.astype(bool)
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+# sharded output of the tables
+#
+# instead of a csv file per table, the tables are appended to a few large
+# shards. A table is one gzip member of a shard holding NDJSON: a JSON array
+# per row. The index of a shard tells for each table the page url, the table
+# name, the columns and their dtypes, and the offset and length of its member,
+# so a table is read without reading the rest of the shard.
+#
+#   <out>/shards/shard-00001.ndjson.gz
+#   <out>/shards/shard-00001.index.json
+#
+# a shard is written as .tmp files and renamed when it is finished, the index
+# last, so a reader only sees finished shards. When a page is written again,
+# the tables of the newest shard replace the older ones.
+#
+# a table with the same content hash as a table written before (see
+# table_memo) is not written again, its index entry names the shard, offset
+# and length of the first copy.
+#
+# the tables replaced by a newer version of their page stay in the older
+# shards until the shards are compacted: compact() copies the tables still in
+# use to new shards and removes the old ones. get_tables.py compacts the
+# shards at the end of a crawl when more than half of their bytes are
+# replaced tables, or at once with
+#
+#   python3 shards.py OUT/shards
+
+import argparse
+import glob
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import numpy as np
+import pandas as pd
+
+_SHARD = re.compile(r'shard-([0-9]+)\.index\.json$')
+
+# a JSON value of a cell, NaN is null
+def _json_value(value):
+    if isinstance(value, (np.integer,)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return None if np.isnan(value) else float(value)
+    return value
+
+# the gzip member of a table, the same table always gives the same bytes
+def encode_table(dataframe):
+    rows = [json.dumps([_json_value(v) for v in row]) for row in dataframe.itertuples(index=False, name=None)]
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as f:
+        f.write(('\n'.join(rows) + '\n').encode('utf-8') if rows else b'')
+    return buf.getvalue()
+
+# a table from its gzip member and its index entry
+def decode_table(data, entry):
+    names = [name for name, _ in entry['columns']]
+    text = gzip.decompress(data).decode('utf-8')
+    rows = [json.loads(line) for line in text.splitlines() if line]
+    df = pd.DataFrame.from_records(rows, columns=names) if rows else pd.DataFrame(columns=names)
+    # the columns of a single type get it back, like read_csv infers it
+    for name, dtype in entry['columns']:
+        if dtype in ('int64', 'float64'):
+            df[name] = pd.to_numeric(df[name], errors='coerce')
+        elif dtype == 'object':
+            df[name] = df[name].where(df[name].notna(), np.nan)
+    return df
+
+class ShardWriter:
+
+    def __init__(self, outdir, max_bytes=256 << 20):
+        self.outdir = outdir
+        self.max_bytes = max_bytes
+        os.makedirs(outdir, exist_ok=True)
+        existing = [int(m.group(1)) for m in map(_SHARD.search, os.listdir(outdir)) if m]
+        self.seq = max(existing) if existing else 0
+        self.f = None
+        self.index = []
+        # content hash -> index entry of the first copy of a table
+        self.written = {}
+        # the number of tables written as a reference to their first copy
+        self.references = 0
+        for index_path in sorted(glob.glob(os.path.join(outdir, 'shard-*.index.json'))):
+            with open(index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            for entry in index['tables']:
+                if entry.get('hash') is not None and entry['hash'] not in self.written:
+                    self.written[entry['hash']] = dict(entry, shard=entry.get('shard', index['shard']))
+
+    def _path(self, seq, suffix):
+        return os.path.join(self.outdir, 'shard-{:05d}{}'.format(seq, suffix))
+
+    def _open(self):
+        self.seq += 1
+        self.f = open(self._path(self.seq, '.ndjson.gz.tmp'), 'wb')
+        self.index = []
+
+    # append the tables of a page, a list of (name, dataframe), hashes are
+    # their content hashes. A page without tables gets an entry without table,
+    # so it replaces the tables of an older version of the page
+    def write(self, url, tables, hashes=None):
+        if self.f is None:
+            self._open()
+        if not tables:
+            self.index.append({'url': url, 'table': None})
+        for (name, dataframe), content_hash in zip(tables, hashes or [None] * len(tables)):
+            first = self.written.get(content_hash)
+            if first is not None:
+                self.index.append(dict(first, url=url, table=name))
+                self.references += 1
+                continue
+            data = encode_table(dataframe)
+            entry = {
+                'url': url,
+                'table': name,
+                'columns': [[str(col), str(dtype)] for col, dtype in dataframe.dtypes.items()],
+                'rows': len(dataframe),
+                'shard': os.path.basename(self._path(self.seq, '.ndjson.gz')),
+                'offset': self.f.tell(),
+                'length': len(data),
+                'sha1': hashlib.sha1(data).hexdigest(),
+                'hash': content_hash,
+            }
+            self.index.append(entry)
+            if content_hash is not None:
+                self.written[content_hash] = entry
+            self.f.write(data)
+        if self.f.tell() >= self.max_bytes:
+            self.finish()
+
+    # finish the current shard: the data, then the index are renamed to
+    # their final names
+    def finish(self):
+        if self.f is None:
+            return
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+        self.f = None
+        index_tmp = self._path(self.seq, '.index.json.tmp')
+        with open(index_tmp, 'w', encoding='utf-8') as f:
+            json.dump({'shard': os.path.basename(self._path(self.seq, '.ndjson.gz')), 'tables': self.index}, f)
+        os.replace(self._path(self.seq, '.ndjson.gz.tmp'), self._path(self.seq, '.ndjson.gz'))
+        os.replace(index_tmp, self._path(self.seq, '.index.json'))
+
+    def close(self):
+        self.finish()
+
+# check if a file name is the index of a finished shard
+def is_shard_index(name):
+    return _SHARD.search(name) is not None
+
+# the tables of the finished shards of a list of indexes, the newest version
+# of each page only. Returns a list of index entries with the path of their
+# shard
+def shard_tables(index_paths):
+    indexes = []
+    for index_path in index_paths:
+        m = _SHARD.search(index_path)
+        indexes.append((os.path.dirname(index_path), int(m.group(1)), index_path))
+    # page url -> (shard dir, seq) of its newest version
+    newest = {}
+    entries = []
+    for shard_dir, seq, index_path in sorted(indexes):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        for entry in index['tables']:
+            entry = dict(entry, shard=os.path.join(shard_dir, entry.get('shard', index['shard'])), seq=(shard_dir, seq))
+            newest[entry['url']] = entry['seq']
+            entries.append(entry)
+    return [entry for entry in entries if newest[entry['url']] == entry['seq'] and entry['table'] is not None]
+
+# read a table of a shard from its index entry
+def read_table(entry):
+    with open(entry['shard'], 'rb') as f:
+        f.seek(entry['offset'])
+        return decode_table(f.read(entry['length']), entry)
+
+# the indexes of the finished shards of a directory
+def _indexes(outdir):
+    return sorted(glob.glob(os.path.join(outdir, 'shard-*.index.json')))
+
+# the bytes of the tables still in use and the bytes of all the finished
+# shards of a directory
+def shard_usage(outdir):
+    indexes = _indexes(outdir)
+    members = {(entry['shard'], entry['offset']): entry['length'] for entry in shard_tables(indexes)}
+    total = sum(os.path.getsize(path[:-len('.index.json')] + '.ndjson.gz') for path in indexes)
+    return sum(members.values()), total
+
+# copy the tables still in use to new shards and remove the old shards,
+# returns the number of bytes freed. The tables of a page stay in the same
+# shard, and a table written once for several pages is still copied once.
+# The new shards are finished before the old ones are removed, so a crawl
+# stopped in between only leaves duplicates behind
+def compact(outdir, max_bytes=256 << 20):
+    indexes = _indexes(outdir)
+    if not indexes:
+        return 0
+    live, total = shard_usage(outdir)
+    pages = {}
+    for entry in shard_tables(indexes):
+        pages.setdefault(entry['url'], []).append(entry)
+    writer = ShardWriter(outdir, max_bytes=max_bytes)
+    writer.written = {}
+    # (old shard, offset) -> entry of the copy
+    copies = {}
+    files = {}
+    try:
+        for url, entries in pages.items():
+            if writer.f is None:
+                writer._open()
+            for entry in entries:
+                key = (entry['shard'], entry['offset'])
+                if key not in copies:
+                    if entry['shard'] not in files:
+                        files[entry['shard']] = open(entry['shard'], 'rb')
+                    f = files[entry['shard']]
+                    f.seek(entry['offset'])
+                    data = f.read(entry['length'])
+                    copies[key] = {
+                        'shard': os.path.basename(writer._path(writer.seq, '.ndjson.gz')),
+                        'offset': writer.f.tell(),
+                    }
+                    writer.f.write(data)
+                new = {name: value for name, value in entry.items() if name != 'seq'}
+                new.update(copies[key])
+                writer.index.append(new)
+            # a new shard only between two pages, so a page is in one shard
+            if writer.f.tell() >= max_bytes:
+                writer.finish()
+        writer.close()
+    finally:
+        for f in files.values():
+            f.close()
+    for index_path in indexes:
+        os.remove(index_path)
+        os.remove(index_path[:-len('.index.json')] + '.ndjson.gz')
+    return total - live
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compact the shards written by get_tables.py --output shards.')
+    parser.add_argument('SHARDS', type=str, help='the directory of the shards, OUT/shards')
+    parser.add_argument('--shard-size', dest='shard_size', type=int, default=256,
+                        help="size of a shard in MB before a new one is started (default=256)")
+    args = parser.parse_args()
+
+    live, total = shard_usage(args.SHARDS)
+    freed = compact(args.SHARDS, max_bytes=args.shard_size * 1024 * 1024)
+    print('{:.1f} MB of tables in use, {:.1f} MB freed.'.format(live / 1e6, freed / 1e6))
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+# the urls of a SPARQL query, fetched page by page
+#
+# the query is sent with LIMIT/OFFSET, one page of results at a time, and the
+# urls of a page are yielded as soon as it arrives, so the crawl starts with
+# the first page instead of waiting for the whole result. Each page of results
+# is kept as a JSON file in the cache directory and reused while it is younger
+# than max_age.
+#
+#   <cache_dir>/<sha1 of endpoint, query, offset and limit>.json
+
+import hashlib
+import json
+import os
+import re
+import time
+from page_cache import CacheMiss
+from defaults import DEFAULT_ENDPOINT
+
+_ORDER_BY = re.compile(r'\bORDER\s+BY\b', re.I)
+_LIMIT_OFFSET = re.compile(r'\b(LIMIT|OFFSET)\s+[0-9]+\s*$', re.I)
+
+class SparqlSource:
+
+    def __init__(self, query, endpoint=DEFAULT_ENDPOINT, page_size=10000, var='url',
+                 cache_dir=None, max_age=24 * 3600, offline=False):
+        self.query = query.strip()
+        self.endpoint = endpoint
+        self.page_size = page_size
+        # the variable holding the urls
+        self.var = var
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        # only use the cached pages, never query the endpoint
+        self.offline = offline
+        # the number of pages of results fetched from the endpoint and read
+        # from the cache
+        self.queried = 0
+        self.cached = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    # the query of a page of results, ordered by the url variable so the pages
+    # do not overlap. A query with its own LIMIT or OFFSET is sent as it is
+    def _page_query(self, offset):
+        if _LIMIT_OFFSET.search(self.query):
+            return self.query
+        query = self.query
+        if not _ORDER_BY.search(query):
+            query += '\nORDER BY ?{}'.format(self.var)
+        return '{}\nLIMIT {} OFFSET {}'.format(query, self.page_size, offset)
+
+    def _cache_path(self, query):
+        key = '{}\n{}'.format(self.endpoint, query).encode('utf-8')
+        return os.path.join(self.cache_dir, hashlib.sha1(key).hexdigest() + '.json')
+
+    # the bindings of a page of results, from the cache or the endpoint
+    def _bindings(self, query):
+        path = self._cache_path(query) if self.cache_dir is not None else None
+        if path is not None and os.path.exists(path) \
+                and (self.offline or time.time() - os.path.getmtime(path) < self.max_age):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.cached += 1
+                return json.load(f)
+        if self.offline:
+            raise CacheMiss(query)
+
+        # imported only when the endpoint is queried
+        from SPARQLWrapper import SPARQLWrapper, JSON
+        sparql = SPARQLWrapper(self.endpoint)
+        sparql.setQuery(query)
+        sparql.setReturnFormat(JSON)
+        bindings = sparql.query().convert()['results']['bindings']
+        self.queried += 1
+        if path is not None:
+            tmp = '{}.{}.tmp'.format(path, os.getpid())
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(bindings, f)
+            os.replace(tmp, path)
+        return bindings
+
+    # yield the urls, page by page
+    def __iter__(self):
+        offset = 0
+        while True:
+            query = self._page_query(offset)
+            bindings = self._bindings(query)
+            for b in bindings:
+                if self.var in b:
+                    yield b[self.var]['value']
+            if query == self.query or len(bindings) < self.page_size:
+                return
+            offset += self.page_size
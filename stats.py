@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+# per-stage timers and counters of the crawl
+#
+# a WikiPage and its WikiTables add the time of each stage and counters to a
+# Stats, each parse worker writes the stats of a page as a JSON line, and
+# get_tables.py merges the lines into a report at the end of the run
+#
+#   download   downloading the page (or reading it from the cache)
+#   backoff    waiting before another try of a download, see fetcher
+#   soup       finding the wikitables and building their soups
+#   spans      building the grid of a table, resolving rowspan and colspan
+#   headers    finding the header rows
+#   cells      cleaning the cells and extracting their values
+#   summary    removing the summary rows
+#   frame      typing the columns and building the dataframe
+#   logging    formatting the tables for the log
+#   csv        writing the csv files
+#   shards     appending the tables to the shards, see shards
+
+import json
+import time
+from contextlib import contextmanager
+
+class Stats:
+
+    def __init__(self, seconds=None, counts=None):
+        # stage -> seconds
+        self.seconds = dict(seconds or {})
+        # counter -> value, e.g. bytes, tables_found, tables_valid, cells
+        self.counts = dict(counts or {})
+
+    # time a stage, the time adds up when a stage runs several times
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + time.perf_counter() - start
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def merge(self, other):
+        for stage, seconds in other.seconds.items():
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+        for name, n in other.counts.items():
+            self.count(name, n)
+
+    def total(self):
+        return sum(self.seconds.values())
+
+    def to_dict(self):
+        return {'seconds': self.seconds, 'counts': self.counts}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d.get('seconds'), d.get('counts'))
+
+# a JSON line of the stats of a page
+def stats_line(url, stats, **extra):
+    record = {'url': url}
+    record.update(extra)
+    record.update(stats.to_dict())
+    return json.dumps(record)
+
+# read JSON lines of stats, returns {url: Stats}, the stats of a url in
+# several lines are merged
+def read_stats_lines(lines):
+    pages = {}
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        pages.setdefault(record['url'], Stats()).merge(Stats.from_dict(record))
+    return pages
+
+# the end of run report of the stats of the pages, as a list of lines
+def report(pages, top=10):
+    total = Stats()
+    for stats in pages.values():
+        total.merge(stats)
+    elapsed = total.total()
+    lines = ['{} page(s), {:.2f} s in all stages'.format(len(pages), elapsed)]
+
+    lines.append('{:12s} {:>10s} {:>7s}'.format('stage', 'seconds', '%'))
+    for stage, seconds in sorted(total.seconds.items(), key=lambda item: -item[1]):
+        lines.append('{:12s} {:10.3f} {:6.1f}%'.format(stage, seconds, 100.0 * seconds / elapsed if elapsed else 0.0))
+
+    counts = total.counts
+    lines.append(', '.join('{} {}'.format(name, n) for name, n in sorted(counts.items())))
+    for name, stage in [('bytes', 'download'), ('cells', 'cells')]:
+        if counts.get(name) and total.seconds.get(stage):
+            lines.append('{}: {:.0f} {}/s'.format(stage, counts[name] / total.seconds[stage], name))
+
+    lines.append('slowest pages:')
+    slowest = sorted(pages.items(), key=lambda item: -item[1].total())[:top]
+    for url, stats in slowest:
+        stage, seconds = max(stats.seconds.items(), key=lambda item: item[1]) if stats.seconds else ('-', 0.0)
+        lines.append('{:8.3f} s  {}  (slowest stage: {} {:.3f} s)'.format(stats.total(), url, stage, seconds))
+    return lines
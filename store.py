@@ -0,0 +1,534 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import sys
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from summaries import Summary, summarize_frame
+from predicates import may_match, needs_values, evaluate
+from compact import compact_concat
+from tidy import TidyFrame
+from shards import is_shard_index, shard_tables, read_table
+from wikitable import read_ref
+from urllib.parse import urlparse
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None
+
+# bump when the layout of the cache changes, older caches are rebuilt
+MANIFEST_VERSION = 5
+
+# write a file atomically
+def _write_atomic(path, data):
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+# sha1 of a file
+def _file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+# the csv files, .ref files and shard indexes under a directory, found in a
+# single walk of the tree. Hidden directories like the cache are skipped, as
+# glob does
+def _find_sources(path):
+    csvs, refs, indexes = [], [], []
+    for root, dirs, names in os.walk(path):
+        dirs[:] = [name for name in dirs if not name.startswith('.')]
+        for name in names:
+            if name.startswith('.'):
+                continue
+            if name.endswith('.csv'):
+                csvs.append(os.path.join(root, name))
+            elif name.endswith('.ref'):
+                refs.append(os.path.join(root, name))
+            elif is_shard_index(name):
+                indexes.append(os.path.join(root, name))
+    return csvs, refs, indexes
+
+# store a frame in objects_dir as sha1.feather, or sha1.pkl if Feather cannot
+# hold it, returns the name of the object
+def _store_object(objects_dir, sha1, df):
+    for name in (sha1 + '.feather', sha1 + '.pkl'):
+        if os.path.exists(os.path.join(objects_dir, name)):
+            return name
+    df = df.reset_index(drop=True)
+    path = os.path.join(objects_dir, sha1 + '.feather')
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        df.to_feather(tmp)
+        os.replace(tmp, path)
+        return sha1 + '.feather'
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    _write_atomic(os.path.join(objects_dir, sha1 + '.pkl'), pickle.dumps(df, protocol=4))
+    return sha1 + '.pkl'
+
+# the file of the sketches of the columns of an object, next to it
+def _sketch_path(objects_dir, sha1):
+    return os.path.join(objects_dir, sha1 + '.sketch.pkl')
+
+# True if the object of an entry and its sketches are in objects_dir
+def _has_object(objects_dir, entry):
+    return os.path.exists(os.path.join(objects_dir, entry['object'])) \
+        and os.path.exists(_sketch_path(objects_dir, entry['sha1']))
+
+# store the frame of a csv file or of a table of a shard in objects_dir,
+# returns its entry. The quantile and distinct sketches of the columns are
+# stored next to the object, the manifest only keeps their count, sum, min
+# and max
+def _ingest_frame(objects_dir, df, sha1, mtime, size):
+    obj = _store_object(objects_dir, sha1, df)
+    stats, sketches = summarize_frame(df)
+    _write_atomic(_sketch_path(objects_dir, sha1), pickle.dumps(sketches, protocol=4))
+    return {
+        'mtime': mtime,
+        'size': size,
+        'sha1': sha1,
+        'object': obj,
+        'rows': len(df),
+        # the columns and their dtypes, for the catalog
+        'columns': [[str(col), str(dtype)] for col, dtype in df.dtypes.items()],
+        # the summary of each column, see summaries
+        'stats': stats,
+    }
+
+# bring the entry of a source up to date, runs in the load workers. A source
+# is a csv file whose mtime or size changed, read again only when its content
+# changed, or a table of a shard (a dict, see shards) whose hash changed.
+# Returns (key, entry, True if the source was read)
+def _refresh_source(job):
+    objects_dir, key, source, entry = job
+    if isinstance(source, dict):
+        df = read_table(source)
+        return key, _ingest_frame(objects_dir, df, source['sha1'], os.path.getmtime(source['shard']),
+                                  source['length']), True
+    st = os.stat(source)
+    sha1 = _file_sha1(source)
+    if entry is not None and entry['sha1'] == sha1 and _has_object(objects_dir, entry):
+        # touched but not changed
+        return key, dict(entry, mtime=st.st_mtime), False
+    return key, _ingest_frame(objects_dir, pd.read_csv(source), sha1, st.st_mtime, st.st_size), True
+
+# iterate over items printing the progress on stderr, with tqdm when it is
+# installed
+def _progress(items, total, desc):
+    if tqdm is not None:
+        return tqdm(items, total=total, desc=desc, unit='file')
+    return _print_progress(items, total, desc)
+
+def _print_progress(items, total, desc):
+    step = max(1, total // 100)
+    for i, item in enumerate(items, 1):
+        yield item
+        if i % step == 0 or i == total:
+            sys.stderr.write('\r{}: {}/{} file(s)'.format(desc, i, total))
+            sys.stderr.flush()
+    sys.stderr.write('\n')
+
+# the dtype of a column concatenated from files with the given dtypes, like
+# pd.concat gives it: missing is True when some files do not have the column.
+# None for the dtypes that are not plain numpy numbers, booleans or objects
+def _concat_dtype(dtypes, missing):
+    try:
+        dtypes = [np.dtype(dtype) for dtype in dtypes]
+    except TypeError:
+        return None
+    kinds = set(dtype.kind for dtype in dtypes)
+    if not kinds <= set('biufO'):
+        return None
+    if kinds <= set('iuf'):
+        dtype = np.result_type(*dtypes)
+        return np.dtype(np.float64) if missing and dtype.kind != 'f' else dtype
+    if kinds == {'b'} and not missing:
+        return np.dtype(bool)
+    return np.dtype(object)
+
+# a persistent columnar cache of the csv files under a directory, and of the
+# tables of the shards under it (see shards)
+#
+# a .ref file written by get_tables.py for a table another page already has is
+# read as the csv file it points to. With distinct=True, the tables with the
+# same content as a table before them are left out, so a table included in
+# several pages is only counted once.
+#
+# every csv file is read once and stored as a Feather file (a pickle when
+# pyarrow is not installed or the frame cannot be stored as Feather), named by
+# the hash of the csv. The manifest remembers the mtime, size and hash of each
+# csv file, so a later load only reads the files that changed. The
+# concatenation of all files is kept as a snapshot too, so a load where nothing
+# changed only reads one file. The manifest keeps the count, sum, min and max
+# of each column (see summaries), the quantile and distinct sketches and the
+# distinct values are kept next to the object and only read by summary() and
+# scan().
+#
+# the files that changed are read and summarized by `workers` processes (all
+# the cores by default). The cached frames are read `batch` files at a time,
+# and the concatenation is filled file by file into columns allocated once
+# from the row counts of the manifest, so building it needs little more
+# memory than the result. With progress=True, the progress is shown on stderr.
+#
+#   <path>/.aggcache/manifest.json
+#   <path>/.aggcache/objects/<sha1 of csv>.feather
+#   <path>/.aggcache/objects/<sha1 of csv>.sketch.pkl
+#   <path>/.aggcache/snapshot-<digest>[-compact|-tidy].pkl
+class Store:
+
+    def __init__(self, path, cache_dir=None, distinct=False, workers=None, batch=64, progress=False):
+        self.path = path
+        self.distinct = distinct
+        self.workers = workers or os.cpu_count() or 1
+        self.batch = batch
+        self.progress = progress
+        self.cache_dir = cache_dir or os.path.join(path, '.aggcache')
+        self.objects_dir = os.path.join(self.cache_dir, 'objects')
+        self.manifest_path = os.path.join(self.cache_dir, 'manifest.json')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        # csv path relative to self.path -> entry, in walk order, the
+        # duplicates are only in all_files when distinct is True
+        self.all_files = self._load_manifest()
+        self.files = self.all_files
+        # the number of csv files read by the last refresh, and of the
+        # duplicates left out
+        self.reread = 0
+        self.duplicates = 0
+        # (sha1 of csv, column) -> numeric values, see numeric()
+        self._numeric = {}
+        # sha1 of csv -> the sketches of its columns, see sketches()
+        self._sketches = {}
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if manifest.get('version') != MANIFEST_VERSION:
+            return {}
+        return manifest['files']
+
+    def _save_manifest(self):
+        manifest = {'version': MANIFEST_VERSION, 'files': self.all_files}
+        _write_atomic(self.manifest_path, json.dumps(manifest).encode('utf-8'))
+
+    # bring the cache up to date with the csv files, returns the number of
+    # csv files that had to be read
+    def refresh(self):
+        csv_path_list, refs, indexes = _find_sources(self.path)
+        sources = [(os.path.relpath(csv, self.path), csv) for csv in csv_path_list]
+        for ref in refs:
+            csv = read_ref(ref)
+            if os.path.exists(csv):
+                sources.append((os.path.relpath(ref, self.path), csv))
+        files = {}
+        jobs = []
+        for key, csv in sources:
+            entry = self.all_files.get(key)
+            st = os.stat(csv)
+            if entry is not None and entry['mtime'] == st.st_mtime and entry['size'] == st.st_size \
+                    and _has_object(self.objects_dir, entry):
+                files[key] = entry
+                continue
+            # the place of the file in the walk order
+            files[key] = None
+            jobs.append((self.objects_dir, key, csv, entry))
+        # the tables of the shards, see shards, a table is read again only when
+        # the hash of its data changed
+        for table in shard_tables(indexes):
+            key = '{}/{}'.format(urlparse(table['url']).path.strip('/'), table['table'])
+            entry = self.all_files.get(key)
+            if entry is not None and entry['sha1'] == table['sha1'] and _has_object(self.objects_dir, entry):
+                files[key] = entry
+                continue
+            files[key] = None
+            jobs.append((self.objects_dir, key, table, None))
+        self.reread = 0
+        for key, entry, read in self._map(_refresh_source, jobs, 'read'):
+            files[key] = entry
+            self.reread += read
+        changed = files != self.all_files
+        self.all_files = files
+        if changed:
+            self._save_manifest()
+            # the objects and sketches of the csv files that changed or are gone
+            kept = set()
+            for entry in files.values():
+                kept.add(entry['object'])
+                kept.add(os.path.basename(_sketch_path(self.objects_dir, entry['sha1'])))
+            for old in os.listdir(self.objects_dir):
+                if old not in kept and not old.endswith('.tmp'):
+                    os.remove(os.path.join(self.objects_dir, old))
+        self.files = files
+        self.duplicates = 0
+        if self.distinct:
+            self.files = {}
+            seen = set()
+            for key, entry in files.items():
+                if entry['sha1'] in seen:
+                    self.duplicates += 1
+                    continue
+                seen.add(entry['sha1'])
+                self.files[key] = entry
+        return self.reread
+
+    # map func over jobs with the pool of load workers, in any order
+    def _map(self, func, jobs, desc):
+        results = map(func, jobs)
+        pool = None
+        if self.workers > 1 and len(jobs) > 1:
+            pool = multiprocessing.Pool(min(self.workers, len(jobs)))
+            chunksize = max(1, min(16, len(jobs) // (4 * self.workers)))
+            results = pool.imap_unordered(func, jobs, chunksize)
+        if self.progress and jobs:
+            results = _progress(results, len(jobs), desc)
+        try:
+            for result in results:
+                yield result
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    # the keys of the csv files, in the order they are concatenated
+    def sources(self):
+        return list(self.files)
+
+    # read the cached frame of a csv file, optionally only some columns
+    def read(self, key, columns=None):
+        entry = self.files[key]
+        path = os.path.join(self.objects_dir, entry['object'])
+        if entry['object'].endswith('.pkl'):
+            with open(path, 'rb') as f:
+                df = pickle.load(f)
+            return df if columns is None else df[columns]
+        from pyarrow import feather
+        df = feather.read_table(path, columns=columns, memory_map=True).to_pandas()
+        # Feather gives None for the missing strings, read_csv gives NaN
+        for col in df.columns[df.dtypes == object]:
+            df[col] = df[col].where(df[col].notna(), np.nan)
+        return df
+
+    # the summary of a column of a file, with the sketches read from the file
+    # next to its object unless only the count, sum, min and max are wanted
+    def column_summary(self, key, column, sketches=True):
+        entry = self.files[key]
+        stats = entry['stats'][column]
+        if not sketches:
+            return stats
+        if entry['sha1'] not in self._sketches:
+            with open(_sketch_path(self.objects_dir, entry['sha1']), 'rb') as f:
+                self._sketches[entry['sha1']] = pickle.load(f)
+        return dict(stats, **self._sketches[entry['sha1']][column])
+
+    # map each column name, after column_mapper, to the files containing it
+    #
+    # returns {column: [{'key', 'column', 'dtype', 'rows'}, ...]} where 'column'
+    # is the name in the csv file
+    def catalog(self, column_mapper):
+        catalog = {}
+        for key, entry in self.files.items():
+            for col, dtype in entry['columns']:
+                name = column_mapper.get(col, col)
+                catalog.setdefault(name, []).append(
+                    {'key': key, 'column': col, 'dtype': dtype, 'rows': entry['rows']})
+        return catalog
+
+    # read a single column from the files containing it, only that column is
+    # read from the cache
+    def column(self, name, column_mapper):
+        locations = self.catalog(column_mapper).get(name)
+        if not locations:
+            raise KeyError(name)
+        series = [self.read(loc['key'], [loc['column']])[loc['column']] for loc in locations]
+        return pd.concat(series).rename(name)
+
+    # the numeric values of a column of a file, coerced once and cached for
+    # the next queries
+    def numeric(self, key, col, values=None):
+        cache_key = (self.files[key]['sha1'], col)
+        if cache_key not in self._numeric:
+            if values is None:
+                values = self.read(key, [col])[col]
+            self._numeric[cache_key] = pd.to_numeric(values, errors='coerce').values.astype(np.float64)
+        return self._numeric[cache_key]
+
+    # read the rows matching the predicates of the given columns
+    #
+    # only the files having one of the columns and all the columns of the
+    # predicates are read, and a file is skipped without reading it when the
+    # summaries of its columns (min, max and distinct values) show that no row
+    # can match. Yields a frame per file with the columns named as in the
+    # catalog, a column the file does not have is NaN. The columns in numeric
+    # are returned as floats, the columns in extra are read when a file has
+    # them but do not make a file relevant.
+    def scan(self, columns, predicates, column_mapper, numeric=(), extra=()):
+        catalog = self.catalog(column_mapper)
+        where_columns = [col for col, _, _ in predicates]
+        wanted = list(dict.fromkeys(list(columns) + list(extra) + where_columns))
+
+        # file -> {column: column in the csv file}
+        files = {}
+        for name in wanted:
+            for loc in catalog.get(name, []):
+                files.setdefault(loc['key'], {}).setdefault(name, loc['column'])
+
+        self.scanned = 0
+        self.skipped = 0
+        for key, names in files.items():
+            if not all(col in names for col in where_columns) or not any(col in names for col in columns):
+                continue
+            if not all(may_match(self.column_summary(key, names[col], needs_values(op, value)), op, value)
+                       for col, op, value in predicates):
+                self.skipped += 1
+                continue
+            self.scanned += 1
+            raw = self.read(key, sorted(set(names.values())))
+            data = {}
+            for name in wanted:
+                if name not in names:
+                    data[name] = np.nan
+                elif name in numeric:
+                    data[name] = self.numeric(key, names[name], raw[names[name]])
+                else:
+                    data[name] = raw[names[name]].values
+            df = pd.DataFrame(data, index=raw.index)
+            mask = np.ones(len(df), dtype=bool)
+            for col, op, value in predicates:
+                mask &= evaluate(raw[names[col]], op, value, self.numeric(key, names[col], raw[names[col]]))
+            yield df[mask]
+
+    # the merged summary of a column over all the files containing it
+    def summary(self, name, column_mapper):
+        locations = self.catalog(column_mapper).get(name)
+        if not locations:
+            raise KeyError(name)
+        return Summary([self.column_summary(loc['key'], loc['column']) for loc in locations])
+
+    # digest of the current files and the column mapping
+    def _digest(self, column_mapper):
+        h = hashlib.sha1()
+        h.update(json.dumps(sorted(column_mapper.items())).encode('utf-8'))
+        for key, entry in self.files.items():
+            h.update(key.encode('utf-8'))
+            h.update(entry['sha1'].encode('utf-8'))
+        return h.hexdigest()
+
+    # a frame built from all csv files, kept as a snapshot until the files or
+    # the column mapping change. kind names the layout of the snapshot
+    def _snapshot(self, column_mapper, kind, build):
+        digest = self._digest(column_mapper)
+        name = 'snapshot-{}{}.pkl'.format(digest, '-' + kind if kind else '')
+        snapshot = os.path.join(self.cache_dir, name)
+        if os.path.exists(snapshot):
+            with open(snapshot, 'rb') as f:
+                return pickle.load(f)
+
+        result = build(self.frames(column_mapper))
+
+        # the snapshots of older files
+        for old in os.listdir(self.cache_dir):
+            if old.startswith('snapshot-') and not old.startswith('snapshot-' + digest):
+                os.remove(os.path.join(self.cache_dir, old))
+        # pickled straight to the file, not to bytes as large as the result
+        tmp = '{}.{}.tmp'.format(snapshot, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(result, f, protocol=4)
+        os.replace(tmp, snapshot)
+        return result
+
+    # yield (key, frame) for all csv files in order, with the columns renamed
+    # by column_mapper. The frames are read by a pool of threads `batch` files
+    # at a time, only the frames the caller keeps stay in memory
+    def frames(self, column_mapper):
+        keys = list(self.files)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            batches = (keys[i:i + self.batch] for i in range(0, len(keys), self.batch))
+            read = ((key, df) for batch in batches for key, df in zip(batch, executor.map(self.read, batch)))
+            if self.progress and keys:
+                read = _progress(read, len(keys), 'load')
+            for key, df in read:
+                # like df.rename(columns=column_mapper), without its lookups
+                df.columns = [column_mapper.get(col, col) for col in df.columns]
+                yield key, df
+
+    # the concatenation of the frames of all csv files like pd.concat gives
+    # it, filled frame by frame into columns allocated once from the rows and
+    # dtypes of the manifest
+    def _concat(self, column_mapper):
+        if not self.files:
+            return pd.DataFrame()
+        rows = [entry['rows'] for entry in self.files.values()]
+        total = sum(rows)
+        # column -> dtypes in the files, rows of the files having it
+        dtypes = {}
+        counts = {}
+        for entry in self.files.values():
+            names = [column_mapper.get(col, col) for col, _ in entry['columns']]
+            if len(set(names)) < len(names):
+                # columns with the same name after the mapping, as before
+                return pd.concat([df for _, df in self.frames(column_mapper)])
+            for name, (_, dtype) in zip(names, entry['columns']):
+                dtypes.setdefault(name, set()).add(dtype)
+                counts[name] = counts.get(name, 0) + entry['rows']
+
+        columns = {}
+        # the columns with other dtypes (e.g. the strings of newer pandas) are
+        # filled as objects, column -> the dtypes of their values
+        others = {}
+        for name, names in dtypes.items():
+            dtype = _concat_dtype(names, counts[name] < total)
+            if dtype is None:
+                others[name] = set()
+                dtype = np.dtype(object)
+            if counts[name] < total:
+                columns[name] = np.full(total, np.nan, dtype=dtype)
+            else:
+                columns[name] = np.empty(total, dtype=dtype)
+
+        start = 0
+        for key, df in self.frames(column_mapper):
+            stop = start + len(df)
+            for name in df.columns:
+                values = df[name]
+                if name in others:
+                    others[name].add(values.dtype)
+                    values = values.astype(object)
+                columns[name][start:stop] = values.values
+            start = stop
+
+        index = pd.Index(np.concatenate([np.arange(n) for n in rows]))
+        result = pd.DataFrame(index=index)
+        with warnings.catch_warnings():
+            # inserted one by one, the columns are not copied into blocks
+            warnings.simplefilter('ignore')
+            for name in list(columns):
+                values = columns.pop(name)
+                if len(others.get(name, ())) == 1:
+                    # back to the dtype of the files when they agree
+                    values = pd.Series(values).astype(others[name].pop()).array
+                result[name] = values
+        return result
+
+    # the concatenation of all csv files with columns renamed by column_mapper,
+    # with compact=True the columns use compact dtypes, see compact
+    def concat(self, column_mapper, compact=False):
+        if compact:
+            return self._snapshot(column_mapper, 'compact', lambda frames: compact_concat([df for _, df in frames]))
+        return self._snapshot(column_mapper, '', lambda frames: self._concat(column_mapper))
+
+    # all csv files in the long layout, see tidy
+    def tidy(self, column_mapper):
+        return self._snapshot(column_mapper, 'tidy', TidyFrame.from_frames)
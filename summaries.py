@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+# per-table column summaries computed at ingest time
+#
+# a summary holds the count, sum, min, max and null count of the numeric values
+# of a column, a quantile sketch and a distinct count sketch. Summaries of many
+# tables merge into the summary of the concatenated column, so an aggregate
+# over the whole corpus costs O(tables) instead of a scan of every row.
+
+import base64
+import numpy as np
+import pandas as pd
+
+# a mergeable quantile sketch
+#
+# a column of at most SIZE values is kept as it is; a longer one is reduced to
+# SIZE equi-depth points, each standing for n/SIZE values. Merging keeps the
+# points of both sketches with their weights.
+class QuantileSketch:
+
+    SIZE = 64
+
+    def __init__(self, values=None, weights=None):
+        self.values = np.asarray(values if values is not None else [], dtype=np.float64)
+        self.weights = np.asarray(weights if weights is not None else np.ones(len(self.values)), dtype=np.float64)
+
+    @classmethod
+    def from_values(cls, values):
+        return cls.from_sorted(np.sort(np.asarray(values, dtype=np.float64)))
+
+    @classmethod
+    def from_sorted(cls, values):
+        n = len(values)
+        if n <= cls.SIZE:
+            return cls(values)
+        ranks = np.round((np.arange(cls.SIZE) + 0.5) * n / cls.SIZE - 0.5).astype(np.intp)
+        return cls(values[ranks], np.full(cls.SIZE, n / cls.SIZE))
+
+    # merge many sketches
+    @classmethod
+    def merge_all(cls, sketches):
+        if not sketches:
+            return cls()
+        return cls(np.concatenate([s.values for s in sketches]),
+                   np.concatenate([s.weights for s in sketches]))
+
+    # the q-quantile with linear interpolation, like pandas does on the full
+    # column; exact as long as no sketch was reduced
+    def quantile(self, q):
+        if not len(self.values):
+            return np.nan
+        order = np.argsort(self.values, kind='mergesort')
+        values = self.values[order]
+        weights = self.weights[order]
+        # the position of a point is the middle of the ranks it stands for
+        positions = np.cumsum(weights) - weights + (weights - 1) / 2
+        return float(np.interp(q * (weights.sum() - 1), positions, values))
+
+    def to_dict(self):
+        d = {'values': self.values.tolist()}
+        if (self.weights != 1).any():
+            d['weights'] = self.weights.tolist()
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['values'], d.get('weights'))
+
+# a distinct count sketch
+#
+# the 32-bit hashes of the values are kept exactly while there are few of
+# them, then they are folded into a HyperLogLog with 2**P registers
+class DistinctSketch:
+
+    P = 10
+    SPARSE_MAX = 128
+
+    def __init__(self, hashes=None, registers=None, fold=True):
+        self.hashes = hashes
+        self.registers = registers
+        if fold and self.hashes is not None and len(self.hashes) > self.SPARSE_MAX:
+            self.registers = self._fold(self.hashes)
+            self.hashes = None
+
+    # HyperLogLog registers of 32-bit hashes
+    def _fold(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint32)
+        rest_bits = 32 - self.P
+        index = hashes >> np.uint32(rest_bits)
+        rest = (hashes & np.uint32((1 << rest_bits) - 1)).astype(np.float64)
+        rank = np.where(rest > 0, rest_bits - np.floor(np.log2(np.maximum(rest, 1))), rest_bits + 1)
+        registers = np.zeros(1 << self.P, dtype=np.uint8)
+        np.maximum.at(registers, index.astype(np.intp), rank.astype(np.uint8))
+        return registers
+
+    # merge many sketches, the result stays exact while none of them was
+    # folded into registers
+    @classmethod
+    def merge_all(cls, sketches):
+        hashes = [s.hashes for s in sketches if s.hashes is not None]
+        registers = [s.registers for s in sketches if s.hashes is None]
+        hashes = np.unique(np.concatenate(hashes)) if hashes else np.zeros(0, dtype=np.uint32)
+        if not registers:
+            return cls(hashes, fold=False)
+        registers.append(cls()._fold(hashes))
+        return cls(registers=np.maximum.reduce(registers))
+
+    def estimate(self):
+        if self.hashes is not None:
+            return len(self.hashes)
+        m = float(len(self.registers))
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(2.0 ** -self.registers.astype(np.float64))
+        zeros = np.count_nonzero(self.registers == 0)
+        if raw <= 2.5 * m and zeros:
+            # small range correction
+            return int(round(m * np.log(m / zeros)))
+        return int(round(raw))
+
+    def to_dict(self):
+        if self.hashes is not None:
+            return {'hashes': self.hashes.tolist()}
+        return {'registers': base64.b64encode(self.registers.tobytes()).decode('ascii')}
+
+    @classmethod
+    def from_dict(cls, d):
+        if 'hashes' in d:
+            return cls(np.asarray(d['hashes'], dtype=np.uint32))
+        return cls(registers=np.frombuffer(base64.b64decode(d['registers']), dtype=np.uint8).copy())
+
+# the most distinct values kept in a summary for skipping tables, see
+# predicates.may_match
+ZONE_VALUES = 32
+
+# the parts of a summary kept next to the cached frame instead of in the
+# manifest of the store, see store
+SKETCHES = ('quantiles', 'distinct', 'values')
+
+# the distinct values of a column as strings, None when there are too many
+def _zone_values(values):
+    if len(values) > ZONE_VALUES:
+        return None
+    return sorted(set(str(v) for v in values))
+
+# summarize the columns of a table
+#
+# the numbers of all the columns are put in one array, sorted and hashed at
+# once; the strings of all the columns are hashed at once too. Returns
+# ({column: stats}, {column: sketches}): the stats hold the count, null count,
+# sum, min and max of the numbers of a column, the sketches a quantile sketch,
+# a distinct count sketch and the distinct values as strings (None when there
+# are more than ZONE_VALUES of them)
+def summarize_frame(df):
+    dtypes = list(df.dtypes)
+    # a column per row, the values are converted to numbers in one go
+    raw = df.to_numpy(object).T
+    notna = pd.notna(raw)
+    numbers = pd.to_numeric(raw.ravel(), errors='coerce').astype(np.float64).reshape(raw.shape)
+    present = ~np.isnan(numbers)
+    counts = present.sum(axis=1)
+    sums = np.where(present, numbers, 0.0).sum(axis=1)
+    ordered = np.sort(numbers, axis=1)
+    # numbers are hashed by their numeric value so 3 and '3.0' are the same
+    # value, the other values are hashed as strings
+    number_hashes = (pd.util.hash_array(ordered.ravel()) >> np.uint64(32)).astype(np.uint32).reshape(raw.shape)
+    strings = notna & ~present
+    string_hashes = (pd.util.hash_array(raw[strings].astype(str).astype(object)) >> np.uint64(32)).astype(np.uint32)
+    bounds = np.concatenate([[0], np.cumsum(strings.sum(axis=1))])
+
+    stats, sketches = {}, {}
+    for i, col in enumerate(df.columns):
+        count = int(counts[i])
+        values = ordered[i, :count]
+        first = np.ones(count, dtype=bool)
+        first[1:] = values[1:] != values[:-1]
+        hashes = np.unique(np.concatenate([number_hashes[i, :count][first], string_hashes[bounds[i]:bounds[i + 1]]]))
+        if not pd.api.types.is_numeric_dtype(dtypes[i]):
+            # there are at least as many distinct strings as distinct values
+            zone = _zone_values(set(raw[i][notna[i]])) if len(hashes) <= ZONE_VALUES else None
+        else:
+            # written as the column would be, 2009 and not 2009.0
+            distinct = values[first]
+            if dtypes[i].kind == 'b':
+                distinct = distinct.astype(bool)
+            elif dtypes[i].kind in 'iu':
+                distinct = distinct.astype(np.int64)
+            zone = _zone_values(distinct)
+        stats[str(col)] = {
+            'count': count,
+            'nulls': int(len(df) - notna[i].sum()),
+            'sum': float(sums[i]),
+            'min': float(values[0]) if count else None,
+            'max': float(values[-1]) if count else None,
+        }
+        sketches[str(col)] = {
+            'quantiles': QuantileSketch.from_sorted(values).to_dict(),
+            'distinct': DistinctSketch(hashes).to_dict(),
+            'values': zone,
+        }
+    return stats, sketches
+
+# a merged summary of many columns
+class Summary:
+
+    def __init__(self, summaries):
+        self.count = sum(s['count'] for s in summaries)
+        self.nulls = sum(s['nulls'] for s in summaries)
+        self.sum = float(np.sum([s['sum'] for s in summaries]))
+        mins = [s['min'] for s in summaries if s['min'] is not None]
+        maxs = [s['max'] for s in summaries if s['max'] is not None]
+        self.min = min(mins) if mins else np.nan
+        self.max = max(maxs) if maxs else np.nan
+        self.quantiles = QuantileSketch.merge_all([QuantileSketch.from_dict(s['quantiles']) for s in summaries])
+        self.distinct = DistinctSketch.merge_all([DistinctSketch.from_dict(s['distinct']) for s in summaries])
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else np.nan
+
+    # answer an aggregate, returns None for an unknown aggregate
+    def aggregate(self, agg, q=0.5):
+        if agg in ['mean', 'avg', 'average', 'ave']:
+            return self.mean
+        if agg in ['min', 'minimum']:
+            return self.min
+        if agg in ['max', 'maximum']:
+            return self.max
+        if agg in ['sum']:
+            return self.sum
+        if agg in ['count', 'size']:
+            return self.count
+        if agg in ['median']:
+            return self.quantiles.quantile(0.5)
+        if agg in ['quantile', 'percentile']:
+            return self.quantiles.quantile(q)
+        if agg in ['nunique', 'distinct']:
+            return self.distinct.estimate()
+        return None
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import re
+from bs4 import BeautifulSoup as BS, Tag
+from defaults import BACKENDS
+
+# the backends for finding the wikitables of a page (BACKENDS, see defaults)
+#
+# html.parser: build the soup of the whole page with the pure-Python parser
+# lxml:        parse the page with lxml and rebuild only the wikitables as soup
+# scan:        find the wikitables with a regex scan of the raw html, no tree is
+#              built for the rest of the page
+
+_COMMENT = re.compile(rb'<!--.*?-->', re.S)
+_TABLE_TAG = re.compile(rb'<(/?)table\b([^>]*)>', re.I)
+_CLASS_ATTR = re.compile(rb'''\bclass\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''', re.I)
+
+# check if the attributes of a <table> tag contain the wikitable class
+def _is_wikitable(attrs):
+    m = _CLASS_ATTR.search(attrs)
+    if m is None:
+        return False
+    value = m.group(1) or m.group(2) or m.group(3) or b''
+    return b'wikitable' in value.split()
+
+# return the raw html of every table.wikitable in document order, nested
+# wikitables are returned as well, like soup.findAll does
+def scan_wikitables(content):
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    if b'wikitable' not in content:
+        return []
+    if b'<!--' in content:
+        content = _COMMENT.sub(b'', content)
+
+    fragments = []
+    # the start offsets of the open tables and if they are wikitables
+    stack = []
+    for m in _TABLE_TAG.finditer(content):
+        if not m.group(1):
+            stack.append((m.start(), _is_wikitable(m.group(2))))
+        elif stack:
+            start, is_wikitable = stack.pop()
+            if is_wikitable:
+                fragments.append((start, m.end()))
+
+    # unclosed tables run until the end of the page
+    for start, is_wikitable in stack:
+        if is_wikitable:
+            fragments.append((start, len(content)))
+
+    fragments.sort()
+    return [content[start:end] for start, end in fragments]
+
+# return the raw html of every table.wikitable using lxml
+def lxml_wikitables(content):
+    from lxml import html
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    root = html.fromstring(content, parser=html.HTMLParser(encoding='utf-8'))
+    tables = root.xpath("//table[contains(concat(' ', normalize-space(@class), ' '), ' wikitable ')]")
+    return [html.tostring(t, encoding='utf-8', with_tail=False) for t in tables]
+
+# the wikitables of a page before their soups are built: raw html with the
+# scan and lxml backends, soup nodes with html.parser which builds the soup of
+# the whole page anyway
+def wikitable_fragments(content, backend='scan'):
+    if backend == 'html.parser':
+        soup = BS(content, features="html.parser", from_encoding='utf-8')
+        return soup.findAll("table", attrs={"class": "wikitable"})
+    if backend == 'lxml':
+        return lxml_wikitables(content)
+    if backend == 'scan':
+        return scan_wikitables(content)
+    raise ValueError("Unknown parser backend '{}'.".format(backend))
+
+# the soup of the <table> node of a fragment of wikitable_fragments
+def table_soup(fragment):
+    if isinstance(fragment, Tag):
+        return fragment
+    return BS(fragment, features="html.parser", from_encoding='utf-8').find("table")
+
+# find the wikitables of a page, returns a list of soups of <table> nodes
+def find_wikitables(content, backend='scan'):
+    return [table_soup(fragment) for fragment in wikitable_fragments(content, backend)]
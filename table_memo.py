@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+# the content hash of a wikitable and the memo of the parsed tables
+#
+# the hash of a table is the sha1 of its html without the comments, the <sup>
+# elements (footnote references, removed by WikiTable anyway) and the id
+# attributes, so the same table included in several pages gets the same hash
+# even when its footnotes are numbered differently.
+#
+# the memo maps a table to its parsed dataframe (None for an invalid table),
+# so a table seen before in this crawl or an earlier one is not parsed again.
+# It is shared by the parse workers, every entry is a file written under a
+# temporary name then renamed.
+#
+#   <memo_dir>/<key[:2]>/<key>.pkl
+#   <memo_dir>/SALT
+#
+# the key is made of the hash of the table, MEMO_VERSION and the cleaning
+# rules of rules.py. Bump MEMO_VERSION when the parsing of the tables changes.
+# SALT holds the fingerprint of the entries: when it changed, prune() removes
+# all the entries, none of them can be used anymore. evict() removes the least
+# recently used entries until the memo fits in max_bytes, like the page cache.
+
+import hashlib
+import os
+import pickle
+import re
+import shutil
+from bs4 import Tag
+import rules
+
+MEMO_VERSION = 1
+
+_COMMENT = re.compile(rb'<!--.*?-->', re.S)
+_SUP = re.compile(rb'<sup\b.*?</sup\s*>', re.S | re.I)
+_ID_ATTR = re.compile(rb'''\sid\s*=\s*(?:"[^"]*"|'[^']*'|[^\s>]+)''', re.I)
+
+# the content hash of a wikitable, given as raw html or as a soup node
+def table_hash(fragment):
+    if isinstance(fragment, Tag):
+        fragment = str(fragment).encode('utf-8')
+    html = _COMMENT.sub(b'', fragment)
+    html = _SUP.sub(b'', html)
+    html = _ID_ATTR.sub(b'', html)
+    return hashlib.sha1(html).hexdigest()
+
+# returned by TableMemo.get for a table that is not in the memo
+MISS = object()
+
+# the fingerprint of the parsing: MEMO_VERSION and the rules of rules.py the
+# parsed tables depend on. The crawl manifest keeps it too, so a page parsed
+# with other rules is not taken as unchanged
+def parse_fingerprint():
+    h = hashlib.sha1()
+    h.update(str(MEMO_VERSION).encode('utf-8'))
+    h.update(repr((rules.cell_replace_special_symbols, rules.cell_remove_special_symbols,
+                   rules.summary_row_keywords)).encode('utf-8'))
+    return h.hexdigest()
+
+class TableMemo:
+
+    def __init__(self, root, max_bytes=1 << 30):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        # the version and the rules the entries depend on
+        self.salt = parse_fingerprint()
+
+    def _path(self, content_hash):
+        key = hashlib.sha1((self.salt + content_hash).encode('utf-8')).hexdigest()
+        return os.path.join(self.root, key[:2], key + '.pkl')
+
+    # the dataframe of a table (None if the table is invalid), MISS if the
+    # table is not in the memo
+    def get(self, content_hash):
+        path = self._path(content_hash)
+        try:
+            with open(path, 'rb') as f:
+                dataframe = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return MISS
+        # the mtime is the time of the last use, see evict
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return dataframe
+
+    def put(self, content_hash, dataframe):
+        path = self._path(content_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(dataframe, f, protocol=4)
+        os.replace(tmp, path)
+
+    # remove all the entries when they were made with another fingerprint,
+    # to be called before the workers use the memo
+    def prune(self):
+        salt_path = os.path.join(self.root, 'SALT')
+        try:
+            with open(salt_path, 'r', encoding='utf-8') as f:
+                salt = f.read().strip()
+        except OSError:
+            salt = None
+        if salt == self.salt:
+            return 0
+        removed = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if os.path.isdir(path):
+                removed += len(os.listdir(path))
+                shutil.rmtree(path)
+        tmp = '{}.{}.tmp'.format(salt_path, os.getpid())
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(self.salt + '\n')
+        os.replace(tmp, salt_path)
+        return removed
+
+    # remove the least recently used entries until the memo fits in
+    # max_bytes, returns the number of entries removed
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.root):
+            subdir = os.path.join(self.root, name)
+            if not os.path.isdir(subdir):
+                continue
+            for entry in os.scandir(subdir):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+# a long (tidy) layout of the tables for agg.py
+#
+# the concatenation of the tables has a column for every column name of every
+# table, so its size grows with tables x distinct columns. The long layout
+# keeps one row per cell of a table instead:
+#
+#   table   the csv file, a categorical
+#   row     the row in the table
+#   column  the column name after rules.column_mapper, a categorical
+#   num     the value when it is a number, else NaN
+#   text    the value when it is not a number, else NaN
+#
+# so its size grows with the number of cells. A column or a few columns side by
+# side are rebuilt on demand for peek and agg.
+
+import numpy as np
+import pandas as pd
+
+# the values of cells, numbers as floats
+def _values(cells):
+    values = np.array(cells['text'].values, dtype=object)
+    present = ~np.isnan(cells['num'].values)
+    values[present] = cells['num'].values[present]
+    return values
+
+class TidyFrame:
+
+    def __init__(self, cells):
+        self.cells = cells
+        # column name -> positions of its cells, built on first use
+        self._positions = None
+
+    # build the long layout from {table key: frame} or (table key, frame)
+    # pairs, a frame is not needed anymore once its cells are taken
+    @classmethod
+    def from_frames(cls, frames):
+        tables, rows, columns, nums, texts = [], [], [], [], []
+        keys = []
+        for t, (key, df) in enumerate(frames.items() if isinstance(frames, dict) else frames):
+            keys.append(key)
+            row = np.arange(len(df), dtype=np.int32)
+            for i, name in enumerate(df.columns):
+                values = df.iloc[:, i]
+                num = pd.to_numeric(values, errors='coerce').values.astype(np.float64)
+                text = values.values.astype(object)
+                text[~pd.isna(num)] = np.nan
+                tables.append(np.full(len(df), t, dtype=np.int32))
+                rows.append(row)
+                columns.append(np.full(len(df), str(name), dtype=object))
+                nums.append(num)
+                texts.append(text)
+        if not tables:
+            return cls(pd.DataFrame({'table': [], 'row': [], 'column': [], 'num': [], 'text': []}))
+        cells = pd.DataFrame({
+            'table': pd.Categorical.from_codes(np.concatenate(tables), keys),
+            'row': np.concatenate(rows),
+            'column': pd.Categorical(np.concatenate(columns)),
+            'num': np.concatenate(nums),
+            'text': pd.Series(np.concatenate(texts), dtype=object),
+        })
+        return cls(cells)
+
+    # the positions of the cells of a column, in table order
+    def _cells_of(self, name):
+        if self._positions is None:
+            codes = self.cells['column'].cat.codes.values
+            order = np.argsort(codes, kind='mergesort')
+            bounds = np.searchsorted(codes[order], np.arange(len(self.cells['column'].cat.categories) + 1))
+            self._positions = {str(c): order[bounds[i]:bounds[i + 1]]
+                               for i, c in enumerate(self.cells['column'].cat.categories)}
+        if name not in self._positions:
+            raise KeyError(name)
+        return self._positions[name]
+
+    @property
+    def columns(self):
+        return [str(c) for c in self.cells['column'].cat.categories]
+
+    # the values of a column over the tables having it, numbers as floats,
+    # indexed by the row in the table like the concatenated dataframe
+    def __getitem__(self, name):
+        cells = self.cells.iloc[self._cells_of(name)]
+        return pd.Series(_values(cells), index=cells['row'].values, name=name)
+
+    # the numeric values of a column over the tables having it
+    def numeric(self, name):
+        return self.cells['num'].values[self._cells_of(name)]
+
+    # the columns side by side, one row per row of a table having one of them
+    def frame(self, names):
+        positions = np.sort(np.concatenate([self._cells_of(name) for name in names]))
+        cells = self.cells.iloc[positions]
+        values = _values(cells)
+        df = pd.DataFrame({
+            'table': cells['table'].cat.codes.values,
+            'row': cells['row'].values,
+            'column': cells['column'].astype(object).values,
+            'value': values,
+        })
+        # a table with two columns of the same name keeps the first one
+        df = df[~df.duplicated(['table', 'row', 'column'])]
+        wide = df.set_index(['table', 'row', 'column'])['value'].unstack('column')
+        return wide.reindex(columns=names).reset_index(drop=True)
+
+    # the number of cells, values and memory of each column
+    def info(self):
+        memory = self.cells.memory_usage(index=False, deep=True)
+        print('{:40s} {:>8s} {:>8s} {:>8s}'.format('Column', 'Tables', 'Cells', 'Non-Null'))
+        for name in self.columns:
+            cells = self.cells.iloc[self._cells_of(name)]
+            present = int((~np.isnan(cells['num'].values) | cells['text'].notna().values).sum())
+            print('{:40s} {:>8d} {:>8d} {:>8d}'.format(
+                name, cells['table'].nunique(), len(cells), present))
+        print('{} cells in {} tables, {:.1f} MB in memory'.format(
+            len(self.cells), len(self.cells['table'].cat.categories), memory.sum() / 1024.0 / 1024.0))
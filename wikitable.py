@@ -1,23 +1,18 @@
 # -*- coding: utf-8 -*-
 
-import requests
-from bs4 import BeautifulSoup as BS, NavigableString, Tag
-import pprint
-import sys
-import io
-import operator
-from prettytable import PrettyTable
+# only the modules needed for parsing are imported, this module is loaded by
+# every parse worker, see crawl_worker
 from html_table import HTMLTableParser
-from logger import get_logger
-import argparse
+import logging
 import os
 import re
-import urllib
-from rules import summary_row_keywords, cell_remove_special_symbols, cell_replace_special_symbols
+from column_parser import compiled_rules, extract_values, typed_column, OBJECT
+from page_cache import CacheMiss
+from table_extractor import wikitable_fragments, table_soup
+from table_memo import table_hash, MISS
+from stats import Stats
+import numpy as np
 import pandas as pd
-import pdb
-import unicodedata
-from unidecode import unidecode 
 
 # a class for parsing a single table in Wikipedia
 class WikiTable:
@@ -33,31 +28,33 @@ class WikiTable:
     # columns
     LAST = 'LAST'
     
-    def __init__(self, soup, log, name='default_name'):
+    def __init__(self, soup, log, name='default_name', stats=None):
         self.soup = soup
         self.title = None
         self.headers = []
         self.columns = []
-        self.unmerged_table = []
+        # the kinds of the values in each column, see column_parser
+        self.kinds = []
+        # the distinct cells of the table and the grid of their ids, see
+        # HTMLTableParser
+        self.cells = []
+        self.grid = []
         self.dataframe = None
         self.isvalid = False
+        # the content hash of the html of the table, see table_memo
+        self.hash = None
         self.log = log
         self.string_headers_type = self.JOIN
         self.name = name
+        # the timers and counters of the stages, see stats
+        self.stats = stats if stats is not None else Stats()
     
-    # tell the program how to clean the text
+    # tell the program how to clean the text, see CompiledRules.clean: replace
+    # some characters by another based on the rule, remove accents from a
+    # unicode string, then remove special symbols, like footnote symbols, based
+    # on the rule
     def _clean_text(self, text):
-
-        # replace some characters by another based on the rule
-        for pattern, repl in cell_replace_special_symbols:
-            text = re.sub(pattern, repl, text)
-
-        # remove accents from a unicode string
-        text = unidecode(text)
-
-        # remove special symbols, like footnote symbols, based on the rule
-        text = re.sub(cell_remove_special_symbols, '', text.strip())
-        return text
+        return compiled_rules().clean(text)
 
     # try casting the string to float
     def _to_float(self, texts):
@@ -121,6 +118,10 @@ class WikiTable:
 
         # trim and clean the text first
         text = self._clean_text(element.text)
+        return self._extract_text_value(text, element.find("table") is not None)
+
+    # extract the value of a cleaned cell text
+    def _extract_text_value(self, text, has_table):
 
         # first, try if it can be converted to a numeric
         extracted = self._to_numeric(text)
@@ -138,8 +139,7 @@ class WikiTable:
             return extracted
 
         # nested table?
-        table = element.find("table")
-        if table:
+        if has_table:
             # for now ignore tables inside a cell...
             #
             # texts = []
@@ -173,8 +173,8 @@ class WikiTable:
         while 1:
             row = []
             stop = False
-            for col in self.unmerged_table:
-                cell = col[row_idx]
+            for cellid in self.grid[row_idx]:
+                cell = self.cells[cellid]
                 if cell.name == 'td':
                     # if a row with td is reached, it is likely that the headers stops here
                     stop = True
@@ -205,18 +205,33 @@ class WikiTable:
  
     # determine if a row is a summary row, if so, this should be removed
     def _is_summary_row(self, row):
+        summary = compiled_rules().summary
         for data in row:
             if type(data) == str:
-                if re.match(re.compile(summary_row_keywords, re.IGNORECASE), data) is not None:
+                if summary.match(data) is not None:
                     return True, data
         return False, None
 
-    # remove a row by its index
-    def _remove_row(self, i):
-        # because the data is stored as columns, remove the corresponding value
-        # for all columns
-        for col in self.columns:
-            del col[i]
+    # mark the cells matching the summary keywords, returns a boolean mask of
+    # shape (rows, columns)
+    def _summary_mask(self):
+        mask = np.zeros((self.count_rows(), self.count_cols()), dtype=bool)
+        kinds = np.column_stack(self.kinds)
+        rows, cols = np.nonzero(kinds == OBJECT)
+        if not len(rows):
+            return mask
+        strings = np.column_stack(self.columns)[rows, cols]
+        # the same strings repeat a lot, so each distinct one is matched once
+        distinct, inverse = np.unique(strings, return_inverse=True)
+        summary = compiled_rules().summary
+        matched = np.array([summary.match(string) is not None for string in distinct], dtype=bool)
+        mask[rows, cols] = matched[inverse.reshape(-1)]
+        return mask
+
+    # remove the rows where keep is False, in one pass over the columns
+    def _remove_rows(self, keep):
+        self.columns = [col[keep] for col in self.columns]
+        self.kinds = [kinds[keep] for kinds in self.kinds]
 
     # count the number of tags
     def _tag_count(self, tags, tagname):
@@ -226,14 +241,40 @@ class WikiTable:
                 count += 1
         return count
 
-    # return the rows starting with row_index as data, in columns
-    def _parse_data(self, row_idx):
-        columns = []
-        
-        for col in self.unmerged_table:
-            columns.append(list(map(self._extract_data_cell, col[row_idx+1:])))
+    # the ids of the cell elements containing a nested table
+    def _cells_with_table(self):
+        nested = set()
+        for table in self.soup.find_all("table"):
+            for parent in table.parents:
+                if parent is self.soup:
+                    break
+                if parent.name in ('td', 'th'):
+                    nested.add(id(parent))
+        return nested
 
-        return columns
+    # return the rows starting with row_index as data, in columns, the values
+    # of a column are an object array and their kinds, see column_parser
+    def _parse_data(self, row_idx):
+        width = len(self.grid[0]) if self.grid else 0
+        rows = self.grid[row_idx+1:]
+        if not rows:
+            return [np.empty(0, dtype=object) for _ in range(width)], [np.empty(0, dtype=np.int8) for _ in range(width)]
+        index = np.array(rows, dtype=np.intp)
+
+        # clean and extract each distinct cell once, all cells at the same time
+        cellids = np.unique(index)
+        elements = [self.cells[cellid] for cellid in cellids]
+        texts = compiled_rules().clean_all([element.text for element in elements])
+        nested = self._cells_with_table()
+        has_table = [id(element) in nested for element in elements]
+        values, kinds = extract_values(texts, has_table, self._extract_text_value)
+
+        # map the grid of cell ids to positions in values
+        position = np.empty(len(self.cells), dtype=np.intp)
+        position[cellids] = np.arange(len(cellids))
+        index = position[index]
+
+        return [values[index[:, j]] for j in range(width)], [kinds[index[:, j]] for j in range(width)]
 
     # check if a value is empty
     def _is_empty(self, value):
@@ -245,67 +286,76 @@ class WikiTable:
     
     # remove all the summary rows
     def _remove_summary_rows(self):
-        cur = 0
-        removed = 0
-        old_idx = 0
-        while cur < self.count_rows():
-            is_summary, s = self._is_summary_row(self.get_row(cur))
-            if is_summary:
-                self.log.info("Row {} looks like a summary row with keyword '{}', removed.".format(old_idx+1, s))
-                self._remove_row(cur)
-                removed += 1
-                old_idx += 1
-                continue
-            cur += 1
-            old_idx += 1
-        self.log.info("Removed {} summary rows.".format(removed))
+        mask = self._summary_mask()
+        summary_rows = np.flatnonzero(mask.any(axis=1))
+        if len(summary_rows):
+            if self.log.isEnabledFor(logging.INFO):
+                # the keyword of a row is its first matching cell
+                keywords = [self.columns[j][i] for i, j in zip(summary_rows, mask[summary_rows].argmax(axis=1))]
+                self.log.info("Summary rows removed: %s.", ", ".join(
+                    "row %d ('%s')" % (i+1, s) for i, s in zip(summary_rows, keywords)))
+            keep = np.ones(self.count_rows(), dtype=bool)
+            keep[summary_rows] = False
+            self._remove_rows(keep)
+        self.log.info("Removed %d summary rows.", len(summary_rows))
 
     # parse the wikipedia table
     def parse(self):
         try:
-            parser = HTMLTableParser()
-            parser.parse_soup(self.soup)
-            self._remove_reference(self.soup)
-            # convert an html table into a grid without merged cells
-            self.unmerged_table = parser.get_columns()
+            with self.stats.timer('spans'):
+                parser = HTMLTableParser()
+                parser.parse_soup(self.soup)
+                self._remove_reference(self.soup)
+                # convert an html table into a grid without merged cells
+                self.cells = parser.get_cells()
+                self.grid = parser.get_grid()
         except Exception as e:
             self.log.warn(e)
             self.log.warn("HTMLTableParser: unable to parse raw html table.")
             return False
         try:
-            self.headers, row_idx = self._parse_headers()
+            with self.stats.timer('headers'):
+                self.headers, row_idx = self._parse_headers()
         except Exception as e:
             self.log.warn(e)
             self.log.warn("Unable to parse header.")
             return False
         try:
-            self.columns = self._parse_data(row_idx)
+            with self.stats.timer('cells'):
+                self.columns, self.kinds = self._parse_data(row_idx)
         except Exception as e:
             self.log.warn(e)
             self.log.warn("Unable to parse data.")
             return False
+        self.stats.count('cells', sum(len(col) for col in self.columns))
         
         if not all(len(self.columns[0]) == len(col) for col in self.columns):
             self.log.warn("Columns don't have the same number of entries. Expect {}".format(len(self.columns[0])))
             return False
 
         # remove the summary rows
-        self._remove_summary_rows()
+        with self.stats.timer('summary'):
+            self._remove_summary_rows()
 
-        self.log.debug(self.string_headers())
-        self.log.debug(self.columns)
+        if self.log.isEnabledFor(logging.DEBUG):
+            with self.stats.timer('logging'):
+                self.log.debug('%s', self.string_headers())
+                self.log.debug('%s', self.columns)
 
-        # add only non-empty columns
-        mapping = {}
-        for i, h in enumerate(self.string_headers()):
-            if not self._is_empty_list(self.columns[i]):
-                mapping[h] = self.columns[i]
+        with self.stats.timer('frame'):
+            # add only non-empty columns, as typed arrays
+            empty = [self._is_empty_list(col) for col in self.columns]
+            self.columns = [typed_column(col, kinds) for col, kinds in zip(self.columns, self.kinds)]
+            mapping = {}
+            for i, h in enumerate(self.string_headers()):
+                if not empty[i]:
+                    mapping[h] = self.columns[i]
 
-        nattr = len(mapping)
+            nattr = len(mapping)
 
-        # convert into a dataframe
-        self.dataframe = pd.DataFrame(mapping)
-        self.dataframe.infer_objects()
+            # convert into a dataframe
+            self.dataframe = pd.DataFrame(mapping)
+            self.dataframe.infer_objects()
 
         if self.dataframe.empty:
             self.isvalid = False
@@ -314,6 +364,15 @@ class WikiTable:
         self.isvalid = True
         return True
     
+    # restore a table parsed before from its dataframe, None for an invalid
+    # table, see table_memo
+    def restore(self, dataframe):
+        self.dataframe = dataframe
+        self.isvalid = dataframe is not None
+        if self.isvalid:
+            self.headers = [[str(col)] for col in dataframe.columns]
+            self.columns = [dataframe[col].values for col in dataframe.columns]
+
     # returns a list of headers as a list of strings
     def string_headers(self):
         if self.string_headers_type == self.JOIN:
@@ -363,49 +422,143 @@ class TableNameFactory:
 # a class for parsing all tables in a wikipedia page
 class WikiPage:
 
-    def __init__(self, url, log):
+    def __init__(self, url, log, cache=None, offline=False, backend='scan', memo=None):
         self.url = url
         self.tables = []
         self.log = log
         self.table_name_factory = TableNameFactory()
+        # a PageCache, pages are downloaded every time if it is None
+        self.cache = cache
+        # parse only from the cache, never use the network
+        self.offline = offline
+        # how the wikitables are found in the page, see table_extractor
+        self.backend = backend
+        # a TableMemo, the tables already parsed are taken from it
+        self.memo = memo
+        # the timers and counters of the stages of the page and its tables,
+        # see stats
+        self.stats = Stats()
     
     # get table's name, not implemented
     def _get_table_name(self, table):
         return None
 
-    # parse all tables in a Wikipedia page
-    def parse_tables(self):
-        self.log.info("GET " + self.url)
-        r = requests.get(self.url)
-        self.log.info("Response: {}".format(r.status_code))
-        soup = BS(r.content, features="html.parser", from_encoding='utf-8')
-        tables = soup.findAll("table", attrs={"class": "wikitable"})
-        self.log.info("{} table(s) found.".format(len(tables)))
+    # download the page, through the cache if there is one
+    def _fetch(self):
+        if self.cache is not None:
+            status, content = self.cache.fetch(self.url, offline=self.offline)
+        elif self.offline:
+            raise CacheMiss(self.url)
+        else:
+            import requests
+            r = requests.get(self.url)
+            status, content = r.status_code, r.content
+        self.log.info("Response: %s", status)
+        return content
+
+    # parse all tables in a Wikipedia page, the page is downloaded unless its
+    # content is given
+    def parse_tables(self, content=None):
+        if content is None:
+            self.log.info("GET %s", self.url)
+            try:
+                with self.stats.timer('download'):
+                    content = self._fetch()
+            except CacheMiss:
+                self.log.warn("Offline mode: {} is not in the cache, skipped.".format(self.url))
+                return
+        self.stats.count('bytes', len(content))
+        with self.stats.timer('soup'):
+            tables = wikitable_fragments(content, self.backend)
+        self.stats.count('tables_found', len(tables))
+        self.log.info("%d table(s) found.", len(tables))
         nvalid = 0
-        for i, t in enumerate(tables):
-            self.log.info("Parsing table {}/{}...".format(i+1, len(tables)))
+        for i, fragment in enumerate(tables):
+            self.log.info("Parsing table %d/%d...", i+1, len(tables))
+            content_hash = table_hash(fragment)
+            dataframe = self.memo.get(content_hash) if self.memo is not None else MISS
+            with self.stats.timer('soup'):
+                t = table_soup(fragment) if dataframe is MISS else None
             table_name = self._get_table_name(t) or self.table_name_factory.get_name()
-            wtable = WikiTable(t, self.log, name=table_name)
-            wtable.parse()
+            wtable = WikiTable(t, self.log, name=table_name, stats=self.stats)
+            wtable.hash = content_hash
+            if dataframe is MISS:
+                wtable.parse()
+                if self.memo is not None:
+                    self.memo.put(content_hash, wtable.dataframe if wtable.isvalid else None)
+            else:
+                self.log.info("Table %d/%d parsed before, taken from the memo.", i+1, len(tables))
+                self.stats.count('tables_memo')
+                wtable.restore(dataframe)
             if wtable.isvalid:
                 nvalid += 1
                 self.tables.append(wtable)
-                self.log.info("=== TABLE ({}/{}) ===".format(i+1, len(tables)))
-                self.log.info("Number of attributes: {}".format(wtable.count_cols()))
-                self.log.info("Number of rows: {}".format(wtable.count_rows()))
-                self.log.info("\n{}".format(str(wtable)))
-                self.log.info("\n{}".format(str(wtable.dataframe.dtypes)))
-                self.log.info("=== END OF TABLE ===")
-        self.log.info("{}/{} tables are valid.".format(nvalid, len(tables)))
+                self.log.info("Table %d/%d: %d attribute(s), %d row(s).",
+                              i+1, len(tables), wtable.count_cols(), wtable.count_rows())
+                # the whole table is only rendered at DEBUG
+                if self.log.isEnabledFor(logging.DEBUG):
+                    with self.stats.timer('logging'):
+                        self.log.debug("=== TABLE (%d/%d) ===", i+1, len(tables))
+                        self.log.debug("\n%s", wtable)
+                        self.log.debug("\n%s", wtable.dataframe.dtypes)
+                        self.log.debug("=== END OF TABLE ===")
+        self.stats.count('tables_valid', nvalid)
+        self.log.info("%d/%d tables are valid.", nvalid, len(tables))
     
     # save the tables as csv files
     def save(self, outpath='.'):
-        for i, wtable in enumerate(self.tables):
-            self.log.debug("mkdir -p {}".format(outpath))
+        save_tables(self.named_dataframes(), outpath, self.log, self.stats)
+
+    # the valid tables as a list of (name, dataframe), this is what a parse
+    # worker sends to the writer
+    def named_dataframes(self):
+        return [(wtable.name, wtable.dataframe) for wtable in self.tables]
+
+    # the content hashes of the valid tables, in the order of named_dataframes
+    def table_hashes(self):
+        return [wtable.hash for wtable in self.tables]
+
+# save a list of (name, dataframe) as csv files, the time is added to the
+# csv stage of stats if it is given. A file is written under a temporary name
+# then renamed, so a reader never sees a partly written table
+#
+# refs maps the name of a table to the path of a csv file already holding the
+# same table: a <name>.ref file with the path of that file relative to outpath
+# is written instead of a copy, see write_ref and read_ref
+def save_tables(tables, outpath, log, stats=None, refs=None):
+    stats = stats if stats is not None else Stats()
+    refs = refs or {}
+    for name, dataframe in tables:
+        with stats.timer('csv'):
+            log.debug("mkdir -p %s", outpath)
             os.makedirs(outpath, exist_ok=True)
-            fp = os.path.join(outpath, wtable.name + '.csv'.format(i))
-            self.log.info("Write to file {}".format(fp))
-            wtable.dataframe.to_csv(fp, index=False)
+            fp = os.path.join(outpath, name + '.csv')
+            ref = os.path.join(outpath, name + '.ref')
+            if name in refs:
+                log.info("Write to file %s (same table as %s)", ref, refs[name])
+                write_ref(ref, refs[name])
+                stale = fp
+            else:
+                log.info("Write to file %s", fp)
+                tmp = '{}.{}.tmp'.format(fp, os.getpid())
+                dataframe.to_csv(tmp, index=False)
+                os.replace(tmp, fp)
+                stale = ref
+            if os.path.exists(stale):
+                os.remove(stale)
+
+# write a .ref file pointing to a csv file
+def write_ref(ref, csv):
+    tmp = '{}.{}.tmp'.format(ref, os.getpid())
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(os.path.relpath(csv, os.path.dirname(ref)) + '\n')
+    os.replace(tmp, ref)
+
+# the path of the csv file a .ref file points to
+def read_ref(ref):
+    with open(ref, 'r', encoding='utf-8') as f:
+        target = f.read().strip()
+    return os.path.normpath(os.path.join(os.path.dirname(ref), target))
 
 if __name__ == "__main__":
 